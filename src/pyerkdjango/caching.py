@@ -0,0 +1,95 @@
+"""
+This module contains simple in-process caches for data which is derived from the loaded pyerk modules.
+
+All caches are registered by name. They are cleared when the loaded data changes (see util.bump_data_generation).
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# dict like {name1: <LRUCache>, ...}
+CACHES: Dict[str, "LRUCache"] = {}
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit/miss counters and optional expiration of entries.
+    """
+
+    def __init__(self, name: str, maxsize: Optional[int] = 1000, ttl: Optional[float] = None):
+        """
+        :param name:        unique name (used for the statistics)
+        :param maxsize:     maximum number of entries (None means unbounded)
+        :param ttl:         time to live of an entry in seconds (None means no expiration)
+        """
+        assert name not in CACHES, f"duplicate cache name: {name}"
+
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        # dict like {key1: expiration_time1, ...} (only used if ttl is not None)
+        self._expiration_times = {}
+        self._lock = threading.RLock()
+
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is not _MISSING and self.ttl is not None and self._expiration_times[key] < time.monotonic():
+                self._pop(key)
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expiration_times[key] = time.monotonic() + self.ttl
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key) -> None:
+        del self._data[key]
+        self._expiration_times.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expiration_times.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def clear_all() -> None:
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def get_stats() -> Dict[str, dict]:
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,188 @@
+"""
+This module contains the prefix completion for the web editor (see views.get_completions and pyerk-ace.js).
+
+The suggestions (short keys, indexed keys like `I1234["label"]` and relation names like `R4__is_instance_of`) are
+stored in a sorted array. The suggestions matching a prefix form a contiguous range which is found by bisection. The
+matches are ranked by the number of statements in which the respective entity occurs (as subject, predicate or
+object). For prefixes with many matches (e.g. "R" or "I1") the ranked matches are precomputed, i.e. a request does
+not scan the whole range. The index is created once per data generation (see util.bump_data_generation).
+"""
+
+import bisect
+import heapq
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+
+import pyerk
+
+from . import caching
+from . import util
+
+
+# the index of the current data generation; keys: data_generation
+INDEX_CACHE = caching.LRUCache("completion_index", maxsize=1)
+
+# keys like (normalized prefix, limit, data_generation)
+RESULT_CACHE = caching.LRUCache("completion_results", maxsize=settings.COMPLETION_RESULT_CACHE_SIZE)
+
+_INDEX_LOCK = threading.Lock()
+
+# this is larger than every character which can occur in a suggestion
+_MAX_CHAR = chr(0x10FFFF)
+
+# the ranked matches are precomputed for prefixes with more matches than this
+_MAX_SCAN_SIZE = 256
+
+
+def iter_suggestions() -> Iterator[Tuple[pyerk.Entity, str]]:
+    """
+    Yield 2-tuples (entity, suggestion) for all relations and items.
+    """
+
+    all_entities = [*pyerk.ds.relations.values(), *pyerk.ds.items.values()]
+    for entity in all_entities:
+
+        # TODO: implement a more elegant way to exclude auxiliary items
+        if entity.short_key[1] == "a":
+            continue
+
+        yield entity, entity.short_key
+        yield entity, f'{entity.short_key}["{entity.R1}"]'
+        if isinstance(entity, pyerk.Relation):
+            underscore_r1 = entity.R1.replace(" ", "_")
+            yield entity, f"{entity.short_key}__{underscore_r1}"
+
+
+def count_statements() -> Counter:
+    """
+    Return a Counter like {entity_uri1: n1, ...} which contains the number of statements of each entity (as subject,
+    predicate or object).
+    """
+
+    counter = Counter()
+    for entity in [*pyerk.ds.relations.values(), *pyerk.ds.items.values()]:
+        for re_list in entity.get_relations().values():
+            counter[entity.uri] += len(re_list)
+            for re in re_list:
+                counter[re.relation_tuple[1].uri] += 1
+        for re_list in entity.get_inv_relations().values():
+            counter[entity.uri] += len(re_list)
+    return counter
+
+
+class CompletionIndex:
+    """
+    Sorted array of suggestions (case-insensitive) with their usage counts.
+    """
+
+    def __init__(self, suggestions: List[Tuple[str, int]], top_limit: int):
+        """
+        :param suggestions:     list of 2-tuples (suggestion, usage count)
+        :param top_limit:       number of precomputed matches for prefixes with many matches
+        """
+
+        suggestions = sorted(suggestions, key=lambda item: (normalize_prefix(item[0]), item[0]))
+
+        # parallel lists (the keys are used for bisection)
+        self.keys = [normalize_prefix(suggestion) for suggestion, _ in suggestions]
+        self.suggestions = [suggestion for suggestion, _ in suggestions]
+        self.counts = [count for _, count in suggestions]
+
+        # keys: prefixes with more than _MAX_SCAN_SIZE matches, values: indices of the `top_limit` most used matches
+        self.top_limit = top_limit
+        self.top_matches: Dict[str, List[int]] = {}
+        self._precompute_top_matches()
+
+    def _precompute_top_matches(self):
+        # starting from the empty prefix, every prefix with many matches is extended by one character
+        stack = [("", 0, len(self.keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= _MAX_SCAN_SIZE:
+                continue
+            self.top_matches[prefix] = self._rank(lo, hi, self.top_limit)
+
+            i = lo
+            n = len(prefix)
+            while i < hi:
+                if len(self.keys[i]) == n:
+                    # the key equals the prefix (it is the first key of the range)
+                    i += 1
+                    continue
+                child_prefix = self.keys[i][:n + 1]
+                j = bisect.bisect_right(self.keys, child_prefix + _MAX_CHAR, lo=i, hi=hi)
+                stack.append((child_prefix, i, j))
+                i = j
+
+    def _rank(self, lo: int, hi: int, limit: int) -> List[int]:
+        # note: nlargest is stable, i.e. matches with the same count keep the alphabetical order
+        return heapq.nlargest(limit, range(lo, hi), key=self.counts.__getitem__)
+
+    def get_range(self, prefix: str) -> Tuple[int, int]:
+        """
+        Return the index range of all suggestions which start with `prefix` (already normalized).
+        """
+
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_right(self.keys, prefix + _MAX_CHAR, lo=lo)
+        return lo, hi
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        :return:    list of 2-tuples (suggestion, usage count) for the `limit` most used matches
+        """
+
+        prefix = normalize_prefix(prefix)
+        best = self.top_matches.get(prefix) if limit <= self.top_limit else None
+        if best is None:
+            best = self._rank(*self.get_range(prefix), limit)
+        else:
+            best = best[:limit]
+        return [(self.suggestions[i], self.counts[i]) for i in best]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def normalize_prefix(prefix: str) -> str:
+    return prefix.casefold()
+
+
+def create_index() -> CompletionIndex:
+    counter = count_statements()
+    suggestions = [(suggestion, counter[entity.uri]) for entity, suggestion in iter_suggestions()]
+
+    # views.get_completions requests one more suggestion than the limit
+    return CompletionIndex(suggestions, top_limit=settings.COMPLETION_MAX_LIMIT + 1)
+
+
+def get_index() -> CompletionIndex:
+    """
+    Return the index of the current data generation (it is created on demand).
+    """
+
+    with _INDEX_LOCK:
+        key = util.DATA_GENERATION
+        index = INDEX_CACHE.get(key)
+        if index is None:
+            index = create_index()
+            INDEX_CACHE.set(key, index)
+        return index
+
+
+def complete(prefix: str, limit: int) -> List[Tuple[str, int]]:
+    """
+    Return the `limit` most used suggestions which start with `prefix` (case-insensitive). Results are cached.
+
+    :return:    list of 2-tuples (suggestion, usage count)
+    """
+
+    key = (normalize_prefix(prefix), limit, util.DATA_GENERATION)
+    res = RESULT_CACHE.get(key)
+    if res is None:
+        res = get_index().complete(prefix, limit)
+        RESULT_CACHE.set(key, res)
+    return res
@@ -59,6 +59,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # consistent access to the loaded pyerk data (see locking.py)
+    "pyerkdjango.middleware.data_read_lock_middleware",
 ]
 
 ROOT_URLCONF = "pyerkdjango.django_project.urls"
@@ -92,6 +94,26 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # complete pages (see views.cache_page_per_data_version); e.g. a FileBasedCache allows to share the pages between
+    # several server processes
+    "pages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "pyerkdjango-pages",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
+# alias of the cache for complete pages (None disables the page cache) and timeout in seconds
+PAGE_CACHE_ALIAS = "pages"
+PAGE_CACHE_TIMEOUT = 3600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -199,6 +221,87 @@ BLEACH_STRIP_COMMENTS = False
 # Flag to determine if tests are running
 RUNNING_TESTS = False
 
+# Engine for the `/search/` view (see search.py): "icontains" (substring search, default and fallback), "memory"
+# (substring search via an in-memory n-gram index which does not need the db) or "fts5" (opt-in: sqlite full text
+# search ranked by relevance; note: the tokens of the query only match at the beginning of words)
+SEARCH_ENGINE = "icontains"
+
+# number of results per page for the `/search/` view (can be specified by the client up to the maximum)
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 500
+
+# short-lived cache for the responses of the `/search/` view (number of entries, time to live in seconds)
+SEARCH_RESULT_CACHE_SIZE = 500
+SEARCH_RESULT_CACHE_TTL = 60
+
+# number of cached complete result lists of substring-based search engines and maximum length of a cached list (larger
+# results are not cached, see search.search)
+SEARCH_CANDIDATE_CACHE_SIZE = 200
+SEARCH_CANDIDATE_MAX_SIZE = 2000
+
+# opt-in: automatic reload of changed erk modules in the background (see watcher.py; not active during the unittests)
+# inotify is used if the optional package `inotify_simple` is installed (extra `inotify`),
+# otherwise the files are polled
+WATCH_ERK_DATA = False
+WATCHER_POLL_INTERVAL = 1.0
+WATCHER_DEBOUNCE_DELAY = 0.5
+
+# number of relation edges per relation key which are displayed on the entity detail page (further edges are loaded
+# on demand via the `/api/relations/` view)
+RELATIONS_PAGE_SIZE = 20
+RELATIONS_MAX_PAGE_SIZE = 500
+
+# on-disk cache for visualizations (see vis_integration.py); by default it is located in the user cache directory
+# (the env variable PYERKDJANGO_VIS_CACHE_DIR allows to specify another location); directories which were not used
+# for VIS_CACHE_MAX_AGE seconds are removed
+VIS_CACHE_DIR = os.environ.get("PYERKDJANGO_VIS_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "pyerkdjango", "visualizations"
+)
+VIS_CACHE_MAX_AGE = 24 * 3600
+
+# number of worker threads which create visualizations
+VIS_WORKERS = 2
+
+# maximum value for the `depth` parameter of the visualization view and budgets for the visualized graph (larger
+# neighbourhoods are truncated)
+VIS_MAX_DEPTH = 3
+VIS_MAX_NODES = 60
+VIS_MAX_EDGES = 120
+VIS_TIME_BUDGET = 2.0  # seconds for the graph creation (excluding the layout)
+VIS_LAYOUT_TIMEOUT = 20.0  # seconds for the graph layout (graphviz)
+
+# relation keys whose edges are kept first when the visualized graph is truncated (other relations come afterwards)
+VIS_RELATION_PRIORITY = ["R4", "R3", "R5", "R6", "R7", "R8", "R11"]
+
+# sizes of the caches for prepared SPARQL queries and for (partially evaluated) results (see sparql.py)
+SPARQL_PREPARED_QUERY_CACHE_SIZE = 200
+SPARQL_RESULT_CACHE_SIZE = 50
+
+# number of rows per page for the `/sparql/` view (can be specified by the client up to the maximum)
+SPARQL_PAGE_SIZE = 200
+SPARQL_MAX_PAGE_SIZE = 2000
+
+# `/api/sparql` view: maximum number of rows per response, default/maximum timeout (seconds) and number of worker
+# threads for the query evaluation (while all workers are busy further queries are rejected with status 503)
+SPARQL_API_MAX_ROWS = 100000
+SPARQL_API_TIMEOUT = 10.0
+SPARQL_API_MAX_TIMEOUT = 60.0
+SPARQL_API_WORKERS = 2
+
+# `/api/complete` view (editor completion): default and maximum number of suggestions, size of the result cache
+COMPLETION_LIMIT = 20
+COMPLETION_MAX_LIMIT = 200
+COMPLETION_RESULT_CACHE_SIZE = 2000
+
+# Flag to determine if db entities are looked up via an in-process uri→pk map (instead of a query)
+USE_URI_PK_MAP = True
+
+# maximum number of cached html snippets of rendered entities (see views.render_entity_inline)
+RENDER_CACHE_SIZE = 20000
+
+# maximum number of cached dict-representations of entities (see views.represent_entity_as_dict)
+ENTITY_DICT_CACHE_SIZE = 100000
+
 
 class LazyContainer:
     """
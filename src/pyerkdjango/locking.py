@@ -0,0 +1,96 @@
+"""
+This module contains a reader/writer lock which protects the loaded pyerk data (see util.DATA_LOCK).
+
+Requests read the data while they hold a read lock (see middleware.py). (Re)loading and unloading modules needs the
+write lock, i.e. it waits until all current requests are finished and new requests wait until it is done (also
+while it is still waiting).
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class ReadWriteLock:
+    """
+    Lock which is either held by several readers or by one writer. Both kinds of locks are reentrant.
+
+    Waiting writers have priority: new readers wait until they are done (otherwise a constant stream of requests could
+    starve the writers). Threads which already hold a read lock are an exception (they must be able to continue). A
+    thread which holds read locks and acquires the write lock releases its read locks while waiting (i.e. the data
+    might change in between); they are restored afterwards.
+
+    Note: a worker thread of a request (e.g. the sparql api) waits for a waiting writer while the request holds its
+    read lock. Thus the request must not wait for the worker without timeout.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+
+        # dict like {owner1: number_of_read_locks1, ...} (owner: thread ident unless specified otherwise)
+        self._readers: Dict[int, int] = {}
+        self._writer = None
+        self._write_count = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self, owner: Optional[int] = None) -> None:
+        """
+        :param owner:   the thread ident of the reader (default: current thread); the lock must be released with the
+                        same owner (possibly by another thread, see middleware.py)
+        """
+
+        ident = threading.get_ident()
+        if owner is None:
+            owner = ident
+        with self._condition:
+            # (the writer itself can always read)
+            while self._writer != ident and (
+                self._writer is not None or (self._waiting_writers and owner not in self._readers)
+            ):
+                self._condition.wait()
+            self._readers[owner] = self._readers.get(owner, 0) + 1
+
+    def release_read(self, owner: Optional[int] = None) -> None:
+        if owner is None:
+            owner = threading.get_ident()
+        with self._condition:
+            self._readers[owner] -= 1
+            if not self._readers[owner]:
+                self._readers.pop(owner)
+                self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        ident = threading.get_ident()
+        with self._condition:
+            read_count = 0
+            if self._writer != ident:
+                read_count = self._readers.pop(ident, 0)
+                if read_count:
+                    self._condition.notify_all()
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = ident
+            self._write_count += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._write_count -= 1
+                if not self._write_count:
+                    self._writer = None
+                if read_count:
+                    self._readers[ident] = read_count
+                self._condition.notify_all()
@@ -0,0 +1,171 @@
+"""
+simple command to measure the performance of critical code paths via `python manage.py benchmark <name>`
+
+"""
+
+import timeit
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    """
+    run micro-benchmarks (the database is left unchanged)
+    """
+    help = "Measure the performance of critical code paths"
+
+    # the benchmarks should also run if the data is not (yet) available
+    requires_system_checks = []
+
+    benchmark_names = ["uri_lookup", "detail_page", "url_builder"]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "benchmark", choices=self.benchmark_names,
+            help="name of the benchmark",
+        )
+
+        parser.add_argument(
+            "-n",
+            "--entity-counts",
+            help="numbers of (synthetic) entities for which the benchmark is performed",
+            nargs="+",
+            type=int,
+            default=[1000, 10000, 100000],
+        )
+
+        parser.add_argument(
+            "-r",
+            "--repetitions",
+            help="number of repetitions for every measurement",
+            type=int,
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+        method = getattr(self, f"benchmark_{options['benchmark']}")
+        method(**options)
+
+    def benchmark_uri_lookup(self, entity_counts, repetitions, **kwargs):
+        """
+        Measure the latency of the entity lookup which is performed for every detail page (see views.entity_view)
+        in dependence of the number of entities in the db.
+        """
+        from pyerkdjango.models import Entity
+        from pyerkdjango import util
+
+        self.stdout.write(f"{'entities':>10} {'query (µs)':>12} {'uri→pk map (µs)':>16}   query plan")
+
+        for n in entity_counts:
+            with transaction.atomic():
+                entity_list = [Entity(uri=f"erk:/benchmark#I{i}") for i in range(n)]
+                Entity.objects.bulk_create(entity_list, batch_size=util.SQL_BATCH_SIZE)
+
+                uris = [entity.uri for entity in random.choices(entity_list, k=repetitions)]
+                uri_iter = iter(uris * 2)
+
+                t_query = timeit.timeit(lambda: Entity.objects.get(uri=next(uri_iter)), number=repetitions)
+
+                backup = dict(util.URI_PK_MAP)
+                util.URI_PK_MAP.update((entity.uri, entity.pk) for entity in entity_list)
+                try:
+                    t_map = timeit.timeit(lambda: util.get_db_entity(next(uri_iter)), number=repetitions)
+                finally:
+                    util.URI_PK_MAP.clear()
+                    util.URI_PK_MAP.update(backup)
+
+                query_plan = Entity.objects.filter(uri=uris[0]).explain().replace("\n", "; ")
+
+                self.stdout.write(
+                    f"{n:>10} {t_query / repetitions * 1e6:>12.1f} {t_map / repetitions * 1e6:>16.1f}   {query_plan}"
+                )
+
+                # leave the db unchanged
+                transaction.set_rollback(True)
+
+    def benchmark_detail_page(self, entity_counts, repetitions, **kwargs):
+        """
+        Measure the latency of the detail page (see views.entity_view) in dependence of the number of entities in the
+        db, with and without the uri→pk map. The pages of loaded entities are requested while the db additionally
+        contains n synthetic entities. Note: the loaded data is synchronized with the db first.
+        """
+        from django.test import Client, override_settings
+        from django.urls import reverse
+        from pyerkdjango.models import Entity
+        from pyerkdjango import util
+
+        util.reload_data_if_necessary()
+        loaded_uris = list(Entity.objects.values_list("uri", flat=True))
+        client = Client()
+
+        self.stdout.write(f"{'entities':>10} {'query (ms)':>12} {'uri→pk map (ms)':>16}")
+
+        # the page cache would bypass the view
+        with override_settings(ALLOWED_HOSTS=["testserver"], PAGE_CACHE_ALIAS=None):
+            for n in entity_counts:
+                with transaction.atomic():
+                    entity_list = [Entity(uri=f"erk:/benchmark#I{i}") for i in range(n)]
+                    Entity.objects.bulk_create(entity_list, batch_size=util.SQL_BATCH_SIZE)
+
+                    uris = random.choices(loaded_uris, k=min(repetitions, len(loaded_uris)))
+                    urls = [reverse("entitypage", kwargs={"uri": util.urlquote(uri)}) for uri in uris]
+
+                    def get_pages():
+                        for url in urls:
+                            response = client.get(url)
+                            assert response.status_code == 200, f"unexpected status for {url}"
+
+                    # the first requests fill the caches which do not depend on the number of entities
+                    get_pages()
+
+                    with override_settings(USE_URI_PK_MAP=False):
+                        t_query = timeit.timeit(get_pages, number=1)
+                    t_map = timeit.timeit(get_pages, number=1)
+
+                    self.stdout.write(
+                        f"{len(loaded_uris) + n:>10} {t_query / len(urls) * 1e3:>12.2f} "
+                        f"{t_map / len(urls) * 1e3:>16.2f}"
+                    )
+
+                    # leave the db unchanged
+                    transaction.set_rollback(True)
+
+    def benchmark_url_builder(self, entity_counts, repetitions, **kwargs):
+        """
+        Measure the time to create the detail urls of n different entities (see util.q_reverse) compared to calling
+        `reverse` for every entity.
+        """
+        from django.urls import reverse
+        from pyerkdjango import util
+
+        self.stdout.write(f"{'entities':>10} {'reverse (µs)':>14} {'template (µs)':>14} {'cached (µs)':>12}")
+
+        for n in entity_counts:
+            uris = [f"erk:/benchmark/0.1/mod#I{i}" for i in range(n)]
+
+            def use_reverse():
+                for uri in uris:
+                    reverse("entitypage", kwargs={"uri": util.urlquote(uri)})
+
+            def use_template():
+                for uri in uris:
+                    util.q_reverse("entitypage", uri)
+
+            # the result of `reverse` must not change
+            assert all(reverse("entitypage", kwargs={"uri": util.urlquote(uri)}) == util.q_reverse("entitypage", uri)
+                       for uri in uris[:100])
+
+            number = max(1, repetitions // n)
+            t_reverse = timeit.timeit(use_reverse, number=number)
+
+            util.quote_uri_for_url.cache_clear()
+            t_template = timeit.timeit(use_template, number=1)
+            # second run: all quoted uris are cached
+            t_cached = timeit.timeit(use_template, number=number)
+
+            self.stdout.write(
+                f"{n:>10} {t_reverse / number / n * 1e6:>14.2f} {t_template / n * 1e6:>14.2f} "
+                f"{t_cached / number / n * 1e6:>12.2f}"
+            )
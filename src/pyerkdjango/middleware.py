@@ -0,0 +1,31 @@
+"""
+This module contains the middleware which lets every request read the loaded pyerk data consistently (see
+locking.py).
+"""
+
+import threading
+
+from . import util
+
+
+def data_read_lock_middleware(get_response):
+    """
+    Hold the read lock of the loaded data from the call of the view until the response is closed (i.e. until the
+    content is sent, also for streamed responses). Reloads (e.g. by the watcher) wait until the request is finished.
+    """
+
+    def middleware(request):
+        # the server might close the response in another thread
+        owner = threading.get_ident()
+        util.DATA_LOCK.acquire_read(owner)
+        try:
+            response = get_response(request)
+        except BaseException:
+            util.DATA_LOCK.release_read(owner)
+            raise
+
+        # (this list is processed by response.close())
+        response._resource_closers.append(lambda: util.DATA_LOCK.release_read(owner))
+        return response
+
+    return middleware
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pyerkdjango", "0002_entity_languagespecifiedstring_delete_item_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entity",
+            name="content_hash",
+            field=models.CharField(default="", max_length=40),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pyerkdjango", "0003_entity_content_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="entity",
+            name="uri",
+            field=models.TextField(default="(unknown uri)", unique=True),
+        ),
+    ]
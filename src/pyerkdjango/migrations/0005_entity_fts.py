@@ -0,0 +1,41 @@
+# Generated by Django 4.1 on 2026-10-18 11:20
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# see search.FTS_TABLE_NAME
+FTS_TABLE_NAME = "pyerkdjango_entity_fts"
+
+
+def create_fts_table(apps, schema_editor):
+    """
+    Create the virtual table for the full text search (see search.FTS5SearchEngine).
+    For other databases or if sqlite was compiled without FTS5 this is skipped (search then falls back to icontains).
+    """
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE_NAME} "
+            "USING fts5(uri, label, description, content_hash UNINDEXED)"
+        )
+    except OperationalError:
+        # no such module: fts5
+        pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pyerkdjango", "0004_alter_entity_uri"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
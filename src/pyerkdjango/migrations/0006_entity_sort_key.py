@@ -0,0 +1,50 @@
+# Generated by Django 4.1 on 2026-10-18 12:05
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+def clear_entities(apps, schema_editor):
+    """
+    The entity table is only a cache of the loaded pyerk data. Deleting the rows ensures that the new sort key
+    columns are filled during the next call of util.load_erk_entities_to_db.
+    """
+    apps.get_model("pyerkdjango", "Entity").objects.all().delete()
+    apps.get_model("pyerkdjango", "LanguageSpecifiedString").objects.all().delete()
+
+    if schema_editor.connection.vendor == "sqlite":
+        try:
+            schema_editor.execute("DELETE FROM pyerkdjango_entity_fts")
+        except OperationalError:
+            # no such table: sqlite was compiled without FTS5 (see 0005_entity_fts)
+            pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pyerkdjango", "0005_entity_fts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entity",
+            name="sort_auto",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="entity",
+            name="sort_letter",
+            field=models.CharField(default="", max_length=1),
+        ),
+        migrations.AddField(
+            model_name="entity",
+            name="sort_num",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="entity",
+            index=models.Index(fields=["sort_auto", "sort_letter", "sort_num"], name="entity_sort_key_idx"),
+        ),
+        migrations.RunPython(clear_entities, migrations.RunPython.noop),
+    ]
@@ -22,7 +22,7 @@ class Entity(BaseModel):
     id = models.BigAutoField(primary_key=True)
 
     # TODO: this should be renamed to `short_key` (first step: see property `short_key` below)
-    uri = models.TextField(default="(unknown uri)")
+    uri = models.TextField(default="(unknown uri)", unique=True)
 
     # note: in reality this a one-to-many-relationship which in principle could be modeled by a ForeignKeyField
     # on the other side. However, as we might use the LanguageSpecifiedString model also on other fields (e.g.
@@ -30,6 +30,17 @@ class Entity(BaseModel):
     label = models.ManyToManyField(LanguageSpecifiedString)
     description = models.TextField(default="", null=True)
 
+    # hash over label and description; allows to detect changed entities without comparing all fields (see util.py)
+    content_hash = models.CharField(max_length=40, default="")
+
+    # components of the sort key (see search._entity_sort_key) to allow ordering by the database
+    sort_auto = models.BooleanField(default=False)
+    sort_letter = models.CharField(max_length=1, default="")
+    sort_num = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["sort_auto", "sort_letter", "sort_num"], name="entity_sort_key_idx")]
+
     def get_label(self, langtag=None) -> str:
         if langtag is None:
             langtag = settings.LC.DEFAULT_DATA_LANGUAGE
@@ -0,0 +1,115 @@
+"""
+This module contains a precomputed index of the scopes of the loaded entities (see views.render_entity_scopes).
+
+The index is organized per module: The entries of a module are built when the module object in
+`pyerk.ds.uri_mod_dict` changes (i.e. after the module was (re)loaded) and dropped when the module is unloaded. The
+index is synchronized by the functions which load, reload and unload modules (see util.py).
+Entities which do not belong to an indexed module (e.g. builtin entities) are handled without the index.
+"""
+
+import threading
+from collections import namedtuple
+from typing import Dict, List
+
+import pyerk
+
+
+# data of one scope; the relations are stored as tuples of entities (subject, predicate, object)
+ScopeData = namedtuple("ScopeData", ["name", "defining_relations", "statement_relations"])
+
+
+class ScopeIndex:
+
+    def __init__(self):
+        # dict like {mod_uri1: <module object>, ...} for all modules for which the index is up to date
+        self.indexed_mods = {}
+
+        # dict like {mod_uri1: [entity_uri1, ...], ...} (entities of the module which have scopes)
+        self.mod_entity_uris: Dict[str, List[str]] = {}
+
+        # dict like {entity_uri1: [ScopeData(...), ...], ...}
+        self.scopes: Dict[str, List[ScopeData]] = {}
+
+        self.lock = threading.Lock()
+
+    def sync(self) -> List[str]:
+        """
+        Bring the index in sync with the loaded modules.
+
+        :return:    list of the uris of the (re)indexed modules
+        """
+
+        with self.lock:
+            loaded_mods = dict(pyerk.ds.uri_mod_dict)
+
+            for mod_uri, mod in list(self.indexed_mods.items()):
+                if loaded_mods.get(mod_uri) is not mod:
+                    self._remove_mod(mod_uri)
+
+            new_mod_uris = [mod_uri for mod_uri in loaded_mods if mod_uri not in self.indexed_mods]
+            for mod_uri in new_mod_uris:
+                self._add_mod(mod_uri, loaded_mods[mod_uri])
+
+        return new_mod_uris
+
+    def _add_mod(self, mod_uri: str, mod) -> None:
+        entity_uris = []
+        for uri in pyerk.ds.entities_created_in_mod.get(mod_uri, []):
+            entity = pyerk.ds.get_entity_by_uri(uri, strict=False)
+            if entity is None:
+                continue
+            scope_data_list = create_scope_data(entity)
+            if scope_data_list:
+                self.scopes[uri] = scope_data_list
+                entity_uris.append(uri)
+
+        self.mod_entity_uris[mod_uri] = entity_uris
+        self.indexed_mods[mod_uri] = mod
+
+    def _remove_mod(self, mod_uri: str) -> None:
+        for uri in self.mod_entity_uris.pop(mod_uri):
+            self.scopes.pop(uri, None)
+        self.indexed_mods.pop(mod_uri)
+
+    def get_scopes(self, entity: pyerk.Entity) -> List[ScopeData]:
+        """
+        Look up the scopes of an entity. The index is not synchronized here (this happens when modules are loaded,
+        reloaded or unloaded, see util.py); entities of modules whose index entries are not up to date are handled
+        without the index.
+        """
+
+        mod_uri = entity.uri.split(pyerk.settings.URI_SEP)[0]
+        mod = self.indexed_mods.get(mod_uri)
+        if mod is None or mod is not pyerk.ds.uri_mod_dict.get(mod_uri):
+            return create_scope_data(entity)
+        return self.scopes.get(entity.uri, [])
+
+
+def create_scope_data(entity: pyerk.Entity) -> List[ScopeData]:
+    """
+    Collect the data of all scopes of an entity (without using the index).
+    """
+
+    res = []
+    for scope in pyerk.get_scopes(entity):
+
+        # #### first: handle "variables" (locally relevant items) defined in this scope
+
+        items = pyerk.get_items_defined_in_scope(scope)
+        re: pyerk.RelationEdge
+        # currently we only use `R4__instance_of` as "defining relation"
+        defining_relations = []
+        for item in items:
+            for re in pyerk.ds.statements[item.short_key]["R4"]:
+                defining_relations.append(tuple(re.relation_tuple))
+
+        # #### second: handle further relation triples in this scope
+
+        statement_relations = [tuple(re.relation_tuple) for re in pyerk.ds.scope_statements[scope.short_key]]
+
+        res.append(ScopeData(scope.R1, tuple(defining_relations), tuple(statement_relations)))
+
+    return res
+
+
+SCOPE_INDEX = ScopeIndex()
@@ -0,0 +1,492 @@
+"""
+This module contains the search engines which are used for the `/search/` view (see views.get_item).
+
+Every engine translates a query string into an ordered list of uris of matching entities. The engine is selected via
+`settings.SEARCH_ENGINE`. If it is not available (e.g. because the database has no FTS5 support) the icontains-based
+engine is used as fallback.
+
+For engines with substring semantics the complete (ordered) result lists of recent queries are cached if they are
+small (see `settings.SEARCH_CANDIDATE_MAX_SIZE`). A query which extends a cached query (e.g. "contro" -> "control") is
+answered by filtering the cached result in memory (see search).
+"""
+
+import re
+import heapq
+import threading
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.utils import OperationalError
+
+import pyerk
+
+from .models import Entity
+from . import caching
+
+if TYPE_CHECKING:
+    # only for type annotations (util imports this module)
+    from . import util
+
+
+FTS_TABLE_NAME = "pyerkdjango_entity_fts"
+
+# cache for complete result lists; keys like (engine name, case-folded query, data_generation)
+CANDIDATE_CACHE = caching.LRUCache("search_candidates", maxsize=settings.SEARCH_CANDIDATE_CACHE_SIZE)
+
+# case-folded search texts of all entities in the db (see IContainsSearchEngine.get_search_texts); keys: data_generation
+ICONTAINS_TEXT_CACHE = caching.LRUCache("icontains_search_texts", maxsize=1)
+
+# translation table which only converts ASCII letters to lowercase
+ASCII_LOWERCASE_TABLE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# separates the fields of the search text of an entity (prevents matches across field boundaries)
+FIELD_SEP = "\x00"
+
+
+# fields of models.Entity which correspond to _entity_sort_key
+SORT_KEY_FIELDS = ("sort_auto", "sort_letter", "sort_num")
+
+
+def create_search_text(uri: str, record: "util.EntityRecord") -> str:
+    """
+    Return the lowercase text which is searched by the substring-based engines (uri, label and description).
+    """
+    fields = (uri, record.label.content or "", str(record.description or ""))
+    return FIELD_SEP.join(fields).lower()
+
+
+def _entity_sort_key(entity) -> Tuple[bool, str, int]:
+    """
+    Convert an short_key of an entity to a tuple which is used for sorting.
+
+    (Reminder: second character is either a digit or "a" for autocreted items)
+
+    "I25" -> (False, "I", 25)
+    "I1200" -> (False, "I", 1200)       (should come after I25)
+    "Ia1100" -> (True, "I", 1100)       (auto-created items should come last)
+
+    The components are also stored in the database (see SORT_KEY_FIELDS).
+
+    :param entity:
+    :return:
+    """
+
+    uri = entity.uri
+    mod_uri, sk = uri.split(pyerk.settings.URI_SEP)
+
+    if sk[1].isdigit():
+        num = int(sk[1:])
+        auto = False
+    else:
+        num = int(sk[2:])
+        auto = True
+
+    return auto, sk[0], num
+
+
+class SearchEngine:
+    """
+    Base class for all search engines.
+    """
+
+    name = None
+
+    # flag whether the matches of a query are a subset of the matches of its prefixes (in the same order) and can be
+    # determined by `match` (see search)
+    supports_narrowing = False
+
+    def is_available(self) -> bool:
+        return True
+
+    def fold_case(self, text: str) -> str:
+        """
+        Convert the text like the engine does for case-insensitive matching (used by `match` and for cache keys).
+        """
+        return text.lower()
+
+    def match(self, uri: str, q: str) -> bool:
+        """
+        Check in memory if the entity matches the (case-folded) query (only needed if `supports_narrowing` is True).
+        """
+        raise NotImplementedError
+
+    def sync_index(self, records: Dict[str, "util.EntityRecord"], mod_uris: Optional[List[str]] = None) -> None:
+        """
+        Bring the index in sync with the loaded entities (called by util.load_erk_entities_to_db).
+
+        :param records:     dict like {uri1: EntityRecord(...), ...} for all loaded entities (of the given modules)
+        :param mod_uris:    optional list of module uris; if given, only the entities of these modules are synchronized
+        """
+        pass
+
+    def search(self, q: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """
+        :param q:       query string
+        :param offset:  number of matching entities to skip
+        :param limit:   maximum number of returned uris (None means no limit)
+
+        :return:        2-tuple: (list of uris of the matching entities (ordered), total number of matches)
+        """
+        raise NotImplementedError
+
+
+class IContainsSearchEngine(SearchEngine):
+    """
+    Simple substring search via `icontains` (works on every database; needs no index).
+    """
+
+    name = "icontains"
+    supports_narrowing = True
+
+    def fold_case(self, text: str) -> str:
+        if connection.vendor == "sqlite":
+            # LIKE (i.e. icontains) of sqlite is only case-insensitive for ASCII characters
+            return text.translate(ASCII_LOWERCASE_TABLE)
+        return text.lower()
+
+    def sync_index(self, records: Dict[str, "util.EntityRecord"], mod_uris: Optional[List[str]] = None) -> None:
+        # the db has changed
+        ICONTAINS_TEXT_CACHE.clear()
+        CANDIDATE_CACHE.clear()
+
+    def get_search_texts(self) -> Dict[str, str]:
+        """
+        Return a dict like {uri1: text1, ...} with the case-folded search texts (uri, labels and description) of all
+        entities in the db. It is created once per data generation (and after every synchronization of the db).
+        """
+
+        # import here to avoid circular imports
+        from .util import DATA_GENERATION
+
+        texts = ICONTAINS_TEXT_CACHE.get(DATA_GENERATION)
+        if texts is None:
+            # dict like {uri1: [uri1, description1, label1, ...], ...}
+            fields = {}
+            for uri, label, description in Entity.objects.values_list("uri", "label__content", "description"):
+                fields.setdefault(uri, [uri, description or ""]).append(label or "")
+            texts = {uri: self.fold_case(FIELD_SEP.join(field_list)) for uri, field_list in fields.items()}
+            ICONTAINS_TEXT_CACHE.set(DATA_GENERATION, texts)
+        return texts
+
+    def match(self, uri: str, q: str) -> bool:
+        text = self.get_search_texts().get(uri)
+        return text is not None and q in text
+
+    def search(self, q: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        entities = Entity.objects.filter(
+            Q(label__content__icontains=q) | Q(uri__icontains=q) | Q(description__icontains=q)
+        ).distinct()
+
+        total = entities.count()
+
+        uri_qs = entities.order_by(*SORT_KEY_FIELDS).values_list("uri", flat=True)
+        if limit is None:
+            uris = list(uri_qs[offset:])
+        else:
+            uris = list(uri_qs[offset:offset + limit])
+
+        return uris, total
+
+
+class FTS5SearchEngine(SearchEngine):
+    """
+    Full text search based on an SQLite FTS5 virtual table (see migration 0005).
+
+    The rowid of the virtual table is the primary key of the respective entity. Every token of the query is
+    interpreted as prefix (i.e. "contr" matches "controller"). Results are ranked by bm25 where matches in the label
+    are weighted higher than matches in uri or description.
+    """
+
+    name = "fts5"
+
+    # bm25 weights for the columns (uri, label, description)
+    column_weights = (2.0, 10.0, 1.0)
+
+    def __init__(self):
+        self._available = None
+
+    def is_available(self) -> bool:
+        if self._available is None:
+            try:
+                self._available = (
+                    connection.vendor == "sqlite" and FTS_TABLE_NAME in connection.introspection.table_names()
+                )
+            except OperationalError:
+                # db does not yet exist
+                return False
+        return self._available
+
+    def sync_index(self, records: Dict[str, "util.EntityRecord"], mod_uris: Optional[List[str]] = None) -> None:
+        # import here to avoid circular imports
+        from .util import URI_PK_MAP, get_mod_uri_prefixes
+
+        uri_prefixes = get_mod_uri_prefixes(mod_uris) if mod_uris is not None else ("",)
+
+        # dict like {rowid1: (uri1, record1), ...}
+        target = {URI_PK_MAP[uri]: (uri, record) for uri, record in records.items() if uri in URI_PK_MAP}
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid, uri, content_hash FROM {FTS_TABLE_NAME}")
+            indexed_hashes = {rowid: chash for rowid, uri, chash in cursor.fetchall() if uri.startswith(uri_prefixes)}
+
+            obsolete_rowids = [
+                rowid for rowid, chash in indexed_hashes.items()
+                if rowid not in target or target[rowid][1].content_hash != chash
+            ]
+            self.delete_rows(obsolete_rowids)
+
+            obsolete_rowids = set(obsolete_rowids)
+            new_rows = [
+                (rowid, uri, record.label.content or "", str(record.description or ""), record.content_hash)
+                for rowid, (uri, record) in target.items()
+                if rowid not in indexed_hashes or rowid in obsolete_rowids
+            ]
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE_NAME} (rowid, uri, label, description, content_hash) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                new_rows,
+            )
+
+    def search(self, q: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        match_expr = self.create_match_expression(q)
+        if not match_expr:
+            return [], 0
+
+        weights = ", ".join(map(str, self.column_weights))
+
+        # the join ignores rows of entities which are not in the db (anymore); count and result must use the same one
+        from_clause = (
+            f"FROM {FTS_TABLE_NAME} JOIN {Entity._meta.db_table} e "
+            f"ON e.id = {FTS_TABLE_NAME}.rowid AND e.uri = {FTS_TABLE_NAME}.uri WHERE {FTS_TABLE_NAME} MATCH %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) {from_clause}", [match_expr])
+            total = cursor.fetchone()[0]
+
+            # entities with the same rank are ordered by their sort key
+            # sqlite: a negative limit means no limit
+            sort_key_columns = ", ".join(f"e.{field}" for field in SORT_KEY_FIELDS)
+            cursor.execute(
+                f"SELECT {FTS_TABLE_NAME}.uri {from_clause} "
+                f"ORDER BY bm25({FTS_TABLE_NAME}, {weights}), {sort_key_columns} LIMIT %s OFFSET %s",
+                [match_expr, -1 if limit is None else limit, offset],
+            )
+            uris = [row[0] for row in cursor.fetchall()]
+
+        return uris, total
+
+    def delete_rows(self, rowids: Optional[List[int]] = None) -> None:
+        """
+        Delete the rows of the given entities (primary keys) or all rows from the index (called when entities are
+        deleted from the db, also if this engine is not active).
+        """
+
+        # import here to avoid circular imports
+        from .util import _chunks
+
+        if not self.is_available():
+            return
+
+        with connection.cursor() as cursor:
+            if rowids is None:
+                cursor.execute(f"DELETE FROM {FTS_TABLE_NAME}")
+                return
+            for chunk in _chunks(rowids):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"DELETE FROM {FTS_TABLE_NAME} WHERE rowid IN ({placeholders})", chunk)
+
+    @staticmethod
+    def create_match_expression(q: str) -> str:
+        """
+        Convert the user input into a FTS5 query where all tokens must match as prefixes
+
+        "mathematical se" -> '"mathematical"* "se"*'
+        """
+
+        # this corresponds to the default tokenizer (unicode61) which also separates at underscores
+        tokens = re.findall(r"[^\W_]+", q)
+        return " ".join(f'"{token}"*' for token in tokens)
+
+
+class MemorySearchEngine(SearchEngine):
+    """
+    Substring search (same semantics as the icontains-engine) based on an in-memory n-gram index.
+
+    The index is built directly from the loaded entities and does not need the database. Every entity is represented
+    by a lowercase text (uri, label and description). For each n-gram the set of uris whose text contains it is
+    stored. A query is answered by intersecting the sets of its n-grams and checking the remaining candidates.
+    """
+
+    name = "memory"
+    supports_narrowing = True
+
+    # length of the n-grams; shorter queries are answered by scanning all texts
+    n = 3
+
+    def __init__(self):
+        # dicts like {uri1: ..., ...}
+        self.texts: Dict[str, str] = {}
+        self.content_hashes: Dict[str, str] = {}
+        self.sort_keys: Dict[str, Tuple[bool, str, int]] = {}
+
+        # dict like {"set": {uri1, uri2, ...}, ...}
+        self.ngram_index: Dict[str, Set[str]] = {}
+
+        self.lock = threading.Lock()
+
+    def sync_index(self, records: Dict[str, "util.EntityRecord"], mod_uris: Optional[List[str]] = None) -> None:
+        # import here to avoid circular imports
+        from .util import get_mod_uri_prefixes
+
+        uri_prefixes = get_mod_uri_prefixes(mod_uris) if mod_uris is not None else ("",)
+
+        with self.lock:
+            obsolete_uris = [
+                uri for uri, chash in self.content_hashes.items()
+                if uri.startswith(uri_prefixes) and (uri not in records or records[uri].content_hash != chash)
+            ]
+            for uri in obsolete_uris:
+                self._remove(uri)
+
+            for uri, record in records.items():
+                if uri not in self.content_hashes:
+                    self._add(uri, record)
+
+        CANDIDATE_CACHE.clear()
+
+    def _add(self, uri: str, record: "util.EntityRecord") -> None:
+        text = create_search_text(uri, record)
+
+        self.texts[uri] = text
+        self.content_hashes[uri] = record.content_hash
+        self.sort_keys[uri] = _entity_sort_key(record.entity)
+
+        for ngram in self._get_ngrams(text):
+            self.ngram_index.setdefault(ngram, set()).add(uri)
+
+    def _remove(self, uri: str) -> None:
+        text = self.texts.pop(uri)
+        self.content_hashes.pop(uri)
+        self.sort_keys.pop(uri)
+
+        for ngram in self._get_ngrams(text):
+            uri_set = self.ngram_index[ngram]
+            uri_set.discard(uri)
+            if not uri_set:
+                self.ngram_index.pop(ngram)
+
+    def match(self, uri: str, q: str) -> bool:
+        text = self.texts.get(uri)
+        return text is not None and q in text
+
+    def _get_ngrams(self, text: str) -> Set[str]:
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def search(self, q: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        q = self.fold_case(q)
+        with self.lock:
+            ngrams = self._get_ngrams(q)
+            if ngrams:
+                # start with the smallest set to keep the intersection cheap
+                uri_sets = sorted((self.ngram_index.get(ngram, set()) for ngram in ngrams), key=len)
+                candidates = set.intersection(*uri_sets)
+            else:
+                candidates = self.texts.keys()
+
+            res = [uri for uri in candidates if q in self.texts[uri]]
+
+            if limit is None:
+                res.sort(key=self.sort_keys.__getitem__)
+                uris = res[offset:]
+            else:
+                # only the requested page is sorted completely
+                uris = heapq.nsmallest(offset + limit, res, key=self.sort_keys.__getitem__)[offset:]
+
+        return uris, len(res)
+
+
+ENGINES = {
+    engine.name: engine for engine in (IContainsSearchEngine(), FTS5SearchEngine(), MemorySearchEngine())
+}
+
+
+def delete_db_index_rows(pks: Optional[List[int]] = None) -> None:
+    """
+    Remove deleted entities (primary keys; None means all entities) from the indices which are stored in the db.
+    """
+    ENGINES[FTS5SearchEngine.name].delete_rows(pks)
+
+
+def get_search_engine() -> SearchEngine:
+    """
+    Return the engine specified by `settings.SEARCH_ENGINE` (or the icontains-engine as fallback)
+    """
+
+    engine = ENGINES[settings.SEARCH_ENGINE]
+    if not engine.is_available():
+        engine = ENGINES[IContainsSearchEngine.name]
+    return engine
+
+
+def search(q: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+    """
+    Perform the search with the engine specified by `settings.SEARCH_ENGINE` (see SearchEngine.search).
+
+    For engines which support narrowing, small complete results are cached. If the result of the query or of one of its
+    prefixes is cached, it is filtered in memory instead of querying the engine.
+    """
+
+    engine = get_search_engine()
+    if not engine.supports_narrowing:
+        return engine.search(q, offset=offset, limit=limit)
+
+    uris = get_cached_candidates(engine, q)
+    if uris is not None:
+        if limit is None:
+            return uris[offset:], len(uris)
+        return uris[offset:offset + limit], len(uris)
+
+    uris, total = engine.search(q, offset=offset, limit=limit)
+    if total <= settings.SEARCH_CANDIDATE_MAX_SIZE:
+        if offset == 0 and len(uris) == total:
+            all_uris = uris
+        else:
+            all_uris, _ = engine.search(q)
+        set_cached_candidates(engine, q, all_uris)
+
+    return uris, total
+
+
+def get_cached_candidates(engine: SearchEngine, q: str) -> Optional[List[str]]:
+    """
+    Return the complete (ordered) list of uris which match the query if it is cached or if it can be determined from
+    the cached result of a prefix of the query (otherwise None).
+    """
+
+    # import here to avoid circular imports
+    from .util import DATA_GENERATION
+
+    q = engine.fold_case(q)
+    uris = CANDIDATE_CACHE.get((engine.name, q, DATA_GENERATION))
+    if uris is not None:
+        return uris
+
+    # search for the longest cached prefix
+    for i in range(len(q) - 1, 0, -1):
+        prefix_uris = CANDIDATE_CACHE.get((engine.name, q[:i], DATA_GENERATION))
+        if prefix_uris is not None:
+            uris = [uri for uri in prefix_uris if engine.match(uri, q)]
+            CANDIDATE_CACHE.set((engine.name, q, DATA_GENERATION), uris)
+            return uris
+
+    return None
+
+
+def set_cached_candidates(engine: SearchEngine, q: str, uris: List[str]) -> None:
+
+    # import here to avoid circular imports
+    from .util import DATA_GENERATION
+
+    CANDIDATE_CACHE.set((engine.name, engine.fold_case(q), DATA_GENERATION), uris)
@@ -0,0 +1,316 @@
+"""
+This module contains the execution of SPARQL queries for the web application (see views.SearchSparqlView).
+
+Prepared (i.e. parsed and translated) queries are cached by their normalized source text and the prefixes bound to
+the rdf graph (which can be used without declaration). Results are cached per (query, data generation). The rows of a
+result are evaluated on demand (see SparqlResult), i.e. consecutive pages continue the evaluation instead of
+repeating it. Both caches are cleared when the data changes (see util.bump_data_generation) which also triggers the
+recreation of the rdf graph.
+"""
+
+import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from rdflib import URIRef, Literal
+from rdflib.plugins.sparql import prepareQuery
+
+import pyerk
+import pyerk.rdfstack
+
+from . import caching
+from . import util
+
+
+# cache for prepared queries; keys like (normalized query source, namespace bindings of the graph)
+PREPARED_QUERY_CACHE = caching.LRUCache("sparql_prepared_queries", maxsize=settings.SPARQL_PREPARED_QUERY_CACHE_SIZE)
+
+# cache for query results; keys like (normalized query source, data_generation)
+RESULT_CACHE = caching.LRUCache("sparql_results", maxsize=settings.SPARQL_RESULT_CACHE_SIZE)
+
+_GRAPH_LOCK = threading.Lock()
+
+# executes queries with a timeout (see perform_sparql_query_with_timeout)
+_EXECUTOR = ThreadPoolExecutor(max_workers=settings.SPARQL_API_WORKERS, thread_name_prefix="pyerkdjango-sparql")
+
+# one slot per worker; a slot is held until the evaluation has finished (also if the request timed out before)
+_WORKER_SLOTS = threading.BoundedSemaphore(settings.SPARQL_API_WORKERS)
+
+# formats of the sparql api and the corresponding content types (see views.ApiSparqlView)
+OUTPUT_FORMATS = {
+    "json": "application/sparql-results+json",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class InvalidQueryError(ValueError):
+    """
+    The query could not be parsed or translated (e.g. syntax error or undeclared prefix) or is not a SELECT query.
+    """
+    pass
+
+
+class WorkersBusyError(Exception):
+    """
+    All workers for queries with timeout are busy (see perform_sparql_query_with_timeout).
+    """
+    pass
+
+
+class SparqlResult:
+    """
+    Result of a query: names of the variables and rows (tuples of rdflib terms).
+
+    rdflib evaluates queries lazily (except for the parts which need all solutions, e.g. ORDER BY). Thus the rows are
+    only evaluated when they are requested (see get_rows). Evaluated rows are kept, i.e. consecutive pages continue
+    the evaluation instead of repeating it.
+    """
+
+    def __init__(self, vars: Iterable, rows: Iterable):
+        """
+        :param vars:    names of the variables
+        :param rows:    iterable of rows (e.g. the result of rdflib.Graph.query)
+        """
+
+        self.vars = tuple(str(var) for var in vars)
+        self.complete = False
+
+        self._row_iter = iter(rows)
+        self._rows: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def fetch(self, n: Optional[int] = None) -> int:
+        """
+        Evaluate the first `n` rows (all rows if `n` is None).
+
+        :return:    number of evaluated rows
+        """
+
+        with self._lock:
+            while not self.complete and (n is None or len(self._rows) < n):
+                row = next(self._row_iter, None)
+                if row is None:
+                    self.complete = True
+                    # release the rdflib result (and the graph)
+                    self._row_iter = None
+                else:
+                    self._rows.append(tuple(row))
+            return len(self._rows)
+
+    def get_rows(self, offset: int, limit: int) -> List[tuple]:
+        self.fetch(offset + limit)
+        return self._rows[offset:offset + limit]
+
+    def has_more_rows(self, n: int) -> bool:
+        """
+        Return True if the result has more than `n` rows (evaluates at most n + 1 rows).
+        """
+        return self.fetch(n + 1) > n
+
+    def get_total(self) -> Optional[int]:
+        """
+        Return the number of rows if all rows are evaluated (otherwise None).
+        """
+        with self._lock:
+            return len(self._rows) if self.complete else None
+
+    @property
+    def rows(self) -> List[tuple]:
+        """
+        All rows (evaluates the whole result).
+        """
+        self.fetch()
+        return self._rows
+
+
+def normalize_query(qsrc: str) -> str:
+    """
+    Remove leading/trailing whitespace of all lines and empty lines. (Line breaks are kept because they terminate
+    comments.)
+    """
+
+    lines = (line.strip() for line in qsrc.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def get_rdf_graph():
+    """
+    Return the rdf graph of the loaded data (it is created on demand).
+    """
+
+    with _GRAPH_LOCK:
+        if pyerk.ds.rdfgraph is None:
+            pyerk.ds.rdfgraph = pyerk.rdfstack.create_rdf_triples()
+        return pyerk.ds.rdfgraph
+
+
+def get_prepared_query(qsrc: str):
+    """
+    Return the prepared query. The prefixes which are bound to the rdf graph can be used without declaration.
+
+    :raises InvalidQueryError: for invalid queries and queries which are not SELECT queries
+    """
+
+    namespaces = frozenset((prefix, str(ns)) for prefix, ns in get_rdf_graph().namespaces())
+    key = (normalize_query(qsrc), namespaces)
+    query = PREPARED_QUERY_CACHE.get(key)
+    if query is None:
+        try:
+            query = prepareQuery(key[0], initNs=dict(namespaces))
+        except Exception as e:
+            # rdflib raises pyparsing.ParseException for syntax errors but plain exceptions e.g. for undeclared prefixes
+            raise InvalidQueryError(f"{type(e).__name__}: {str(e)}") from e
+        if query.algebra.name != "SelectQuery":
+            # the results of ASK, CONSTRUCT and DESCRIBE queries are not tables (see SparqlResult)
+            raise InvalidQueryError(f"only SELECT queries are supported (got {query.algebra.name})")
+        PREPARED_QUERY_CACHE.set(key, query)
+    return query
+
+
+def perform_sparql_query(qsrc: str) -> SparqlResult:
+    """
+    Start the evaluation of a query on the rdf graph of the loaded data. The rows are evaluated on demand (see
+    SparqlResult). Results are cached (see RESULT_CACHE).
+
+    :raises InvalidQueryError: for invalid queries
+    """
+
+    key = (normalize_query(qsrc), util.DATA_GENERATION)
+    res = RESULT_CACHE.get(key)
+    if res is None:
+        raw_res = get_rdf_graph().query(get_prepared_query(qsrc))
+        res = SparqlResult(raw_res.vars, raw_res)
+        RESULT_CACHE.set(key, res)
+    return res
+
+
+def iter_pyerk_rows(rows: List[tuple]) -> Iterator[list]:
+    """
+    Convert the rdflib terms of the result rows into pyerk entities (or literal values)
+    """
+
+    for row in rows:
+        yield [pyerk.rdfstack.convert_from_rdf_to_pyerk(node) for node in row]
+
+
+def perform_sparql_query_with_timeout(qsrc: str, timeout: float, n_rows: Optional[int] = None) -> SparqlResult:
+    """
+    :param n_rows:  number of rows which are evaluated within the timeout (None means all rows)
+
+    :raises concurrent.futures.TimeoutError:    if the rows are not available after `timeout` seconds (note: the
+                                                evaluation can not be interrupted; it continues in the background and
+                                                the result is cached)
+    :raises WorkersBusyError:                   if all workers are busy (i.e. the query is rejected instead of
+                                                waiting for a worker)
+    :raises InvalidQueryError:                  for invalid queries
+    """
+
+    if not _WORKER_SLOTS.acquire(blocking=False):
+        raise WorkersBusyError(f"all {settings.SPARQL_API_WORKERS} workers are busy")
+
+    def evaluate():
+        try:
+            with util.DATA_LOCK.read():
+                res = perform_sparql_query(qsrc)
+                res.fetch(n_rows)
+            return res
+        finally:
+            _WORKER_SLOTS.release()
+
+    try:
+        future = _EXECUTOR.submit(evaluate)
+    except Exception:
+        _WORKER_SLOTS.release()
+        raise
+    return future.result(timeout=timeout)
+
+
+def iter_serialized_result(res: SparqlResult, rows: List[tuple], output_format: str, labels: bool) -> Iterator[str]:
+    """
+    Serialize the rows of a result (without rendering the entities).
+
+    :param res:             the result (used for the variable names)
+    :param rows:            the rows which should be serialized (e.g. one page of res.rows)
+    :param output_format:   one of OUTPUT_FORMATS
+    :param labels:          flag whether to add a variable `<var>Label` for every variable (the label of the entity)
+    """
+
+    var_names = list(res.vars)
+    if labels:
+        var_names.extend(f"{var}Label" for var in res.vars)
+
+    if output_format == "json":
+        # see https://www.w3.org/TR/sparql11-results-json/
+        yield f'{{"head": {{"vars": {json.dumps(var_names)}}}, "results": {{"bindings": [\n'
+        for i, row in enumerate(rows):
+            bindings = {var: _create_json_binding(node) for var, node in zip(res.vars, row) if node is not None}
+            if labels:
+                bindings.update(
+                    (f"{var}Label", {"type": "literal", "value": label})
+                    for var, label in zip(res.vars, map(get_label, row)) if label is not None
+                )
+            separator = "," if i else ""
+            yield f"{separator}{json.dumps(bindings)}\n"
+        yield "]}}\n"
+
+    elif output_format == "ndjson":
+        for row in rows:
+            values = [_create_plain_value(node) for node in row]
+            if labels:
+                values.extend(map(get_label, row))
+            yield f"{json.dumps(dict(zip(var_names, values)))}\n"
+
+    elif output_format == "csv":
+        writer = csv.writer(_EchoBuffer())
+        yield writer.writerow(var_names)
+        for row in rows:
+            values = [_create_plain_value(node) for node in row]
+            if labels:
+                values.extend(map(get_label, row))
+            yield writer.writerow(["" if value is None else value for value in values])
+
+    else:
+        raise ValueError(f"unknown output format: {output_format}")
+
+
+def get_label(node) -> Optional[str]:
+    if not isinstance(node, URIRef):
+        return None
+    entity = pyerk.ds.get_entity_by_uri(node.toPython(), strict=False)
+    if entity is None:
+        return None
+    return str(entity.R1)
+
+
+def _create_json_binding(node) -> dict:
+    if isinstance(node, URIRef):
+        return {"type": "uri", "value": str(node)}
+    elif isinstance(node, Literal):
+        res = {"type": "literal", "value": str(node)}
+        if node.language:
+            res["xml:lang"] = node.language
+        elif node.datatype:
+            res["datatype"] = str(node.datatype)
+        return res
+    else:
+        # blank node
+        return {"type": "bnode", "value": str(node)}
+
+
+def _create_plain_value(node) -> Optional[str]:
+    if node is None:
+        return None
+    return str(node)
+
+
+class _EchoBuffer:
+    """
+    File-like object which returns the written data (allows to use csv.writer for streaming)
+    """
+
+    def write(self, value):
+        return value
@@ -8,11 +8,63 @@ main_input.setSelectionRange(main_input.value.length, main_input.value.length);
 main_input.focus()
 
 
+// state of the current search (further pages are loaded on scroll)
+let current_query = "";
+let next_offset = null;
+let total = 0;
+let loading_page = false;
+
+// delay (ms) between the last keystroke and the search request
+const SEARCH_DEBOUNCE_DELAY = 150;
+let debounce_timer = null;
+
+// allows to cancel pending requests if the query changes
+let abort_controller = new AbortController();
+
+
+async function fetch_search_page(query, offset, signal){
+    const url = `/search/?q=${encodeURIComponent(query)}&offset=${offset}`;
+    const source = await fetch(url, {signal: signal});
+    return await source.json();
+}
+
+function append_results(data){
+    const new_items = [];
+    data.forEach(function(item){
+//         console.log(`-->${item}`);
+        var li = document.createElement("li");
+        li.insertAdjacentHTML("beforeend", `${item}`);
+        result_list.appendChild(li);
+        new_items.push(li);
+    });
+    // this ensures that math is rendered if it is present (only the new items are processed).
+    MathJax.typeset(new_items);
+}
+
+function update_info(displayed){
+    if (displayed > 0) {
+        info.innerHTML = `Displaying <strong>${displayed}</strong> of <strong>${total}</strong> results`;
+    } else {
+        info.innerHTML = `Found <strong>0</strong> matching results for <strong>"${current_query}"</strong>`;
+    }
+}
+
 async function input_callback(){
     const query = main_input.value;
-    const url = `/search/?q=${main_input.value}`;
-    const source = await fetch(url);
-    const res = await source.json();
+
+    // cancel the requests of the previous query (if they are still pending)
+    abort_controller.abort();
+    abort_controller = new AbortController();
+
+    let res;
+    try {
+        res = await fetch_search_page(query, 0, abort_controller.signal);
+    } catch (e) {
+        if (e.name === "AbortError") {
+            return
+        }
+        throw e;
+    }
 //     console.log(res.data);
 
     result_list.innerHTML = '';
@@ -20,27 +72,57 @@ async function input_callback(){
         console.log(`input empty`);
         return
     }
-    if (res.data.length > 0) {
-        info.innerHTML = `Displaying <strong>${res.data.length}</strong> results`;
-    } else {
-        info.innerHTML = `Found <strong>${res.data.length}</strong> matching results for <strong>"${query}"</strong>`;
-    }
+    current_query = query;
+    next_offset = res.next_offset;
+    total = res.total;
+
+    update_info(res.data.length);
     result_list.prepend(info);
 
     if (res.data.length > 0) {
-        res.data.forEach(function(item){
-//         console.log(`-->${item}`);
-            var li = document.createElement("li");
-            li.insertAdjacentHTML("beforeend", `${item}`);
-            result_list.appendChild(li);
-        });
-        // this ensures that math is rendered if it is present.
-        MathJax.typeset();
+        append_results(res.data);
     }
 }
 
+// load the next page when the end of the result list is reached
+async function load_next_page(){
+    if (loading_page || next_offset === null) {
+        return
+    }
+    loading_page = true;
+    const query = current_query;
+    try {
+        const res = await fetch_search_page(query, next_offset, abort_controller.signal);
+        // ignore the response if the query changed in the meantime
+        if (query == current_query) {
+            next_offset = res.next_offset;
+            total = res.total;
+            append_results(res.data);
+            update_info(result_list.getElementsByTagName('li').length);
+        }
+    } catch (e) {
+        if (e.name !== "AbortError") {
+            throw e;
+        }
+    } finally {
+        loading_page = false;
+    }
+}
+
+// wait until the user stops typing before the request is sent
+function debounced_input_callback(){
+    clearTimeout(debounce_timer);
+    debounce_timer = setTimeout(input_callback, SEARCH_DEBOUNCE_DELAY);
+}
+
+window.addEventListener("scroll", function(event) {
+    const margin = 200;
+    if (window.innerHeight + window.scrollY >= document.body.offsetHeight - margin) {
+        load_next_page();
+    }
+}, false);
 
-main_input.addEventListener("input", input_callback);
+main_input.addEventListener("input", debounced_input_callback);
 
 // if we reload the page with content in the input, the result should be shown directly
 if (main_input.value.length != 0) {
@@ -2,10 +2,14 @@ var editor = ace.edit("editor");
 editor.session.setMode("ace/mode/python");
 editor.setTheme("ace/theme/monokai");
 
-async function get_auto_complete_list(){
-    const url = "/api/get_auto_complete_list";
+// prefix of the last completion request and whether the server returned only a part of the matches
+var last_completion = {prefix: null, truncated: false};
+
+async function get_completions(prefix){
+    const url = "/api/complete?" + new URLSearchParams({prefix: prefix});
     const source = await fetch(url);
     const res = await source.json();
+    last_completion = {prefix: prefix, truncated: res.truncated};
 
     return res.data
 }
@@ -32,30 +36,22 @@ async function save_file(){
     return res.data
 }
 
-// create empty list as fallback
-var auto_complete_list = [];
-
-// make the call to the API
-(async () => {
-    try {
-        auto_complete_list = await get_auto_complete_list();
-        console.log("api call successful");
-    } catch (e) {
-        console.log("api call not successful");
-    }
-    // `text` is not available here
-})();
-
-var staticWordCompleter = {
+// the server returns only the most used suggestions for the current prefix (see /api/complete)
+var serverCompleter = {
     getCompletions: function(editor, session, pos, prefix, callback) {
-        var wordList = auto_complete_list;
-        callback(null, wordList.map(function(word) {
-            return {
-                caption: word,
-                value: word,
-                meta: "static"
-                };
-        }));
+        get_completions(prefix).then(function(completions) {
+            callback(null, completions.map(function(completion) {
+                return {
+                    caption: completion.value,
+                    value: completion.value,
+                    score: completion.score,
+                    meta: "pyerk"
+                    };
+            }));
+        }).catch(function(e) {
+            console.log("api call (complete) not successful");
+            callback(null, []);
+        });
     }
 }
 
@@ -66,7 +62,23 @@ editor.setOptions({
     enableBasicAutocompletion: true
 });
 
-langTools.setCompleters([staticWordCompleter]);
+langTools.setCompleters([serverCompleter]);
+
+// While the popup is open, ace only filters the suggestions which were fetched when it was opened. If the server
+// returned only the most used matches, the suggestions are fetched again when the prefix is extended.
+var completion_util = ace.require("ace/autocomplete/util");
+editor.commands.on("afterExec", function(e) {
+    const completer = editor.completer;
+    if (e.command.name != "insertstring" || !completer || !completer.activated || !last_completion.truncated) {
+        return;
+    }
+    const prefix = completion_util.getCompletionPrefix(editor);
+    if (prefix != last_completion.prefix && prefix.startsWith(last_completion.prefix)) {
+        // prevent the filtering of the outdated list (which might close the popup)
+        completer.changeTimer.cancel();
+        completer.updateCompletions(false);
+    }
+});
 
 editor.focus()
 
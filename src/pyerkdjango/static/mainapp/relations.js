@@ -0,0 +1,32 @@
+// load further relation edges on the entity detail page (see views.get_relations)
+
+document.addEventListener("click", async function(event){
+    const link = event.target.closest(".load-more-relations a");
+    if (!link) {
+        return
+    }
+    event.preventDefault();
+
+    const container = link.closest(".load-more-relations");
+    // the list is the preceding sibling of the container (see widget-entity-relation-groups.html)
+    const relation_list = container.previousElementSibling;
+
+    const source = await fetch(link.href);
+    const res = await source.json();
+
+    res.data.forEach(function(row){
+        relation_list.insertAdjacentHTML("beforeend", row);
+    });
+
+    if (res.next_offset === null) {
+        container.remove();
+    } else {
+        const url = new URL(link.href);
+        url.searchParams.set("offset", res.next_offset);
+        link.href = url.toString();
+        link.textContent = `load more (${res.total - res.next_offset} remaining)`;
+    }
+
+    // this ensures that math is rendered if it is present.
+    MathJax.typeset();
+});
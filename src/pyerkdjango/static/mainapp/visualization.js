@@ -0,0 +1,23 @@
+// load the visualization on the entity detail page as soon as it is available (see views.entity_visualization_svg)
+
+const svg_container = document.getElementById("svg-content");
+const poll_interval_ms = 500;
+
+async function load_visualization(){
+    const source = await fetch(svg_container.dataset.svgUrl);
+
+    if (source.status == 202) {
+        // the visualization is still being created
+        setTimeout(load_visualization, poll_interval_ms);
+    } else if (source.ok) {
+        svg_container.innerHTML = await source.text();
+    } else {
+        // error responses contain a message (see views.entity_visualization_svg)
+        const data = await source.json().catch(() => ({}));
+        svg_container.textContent = data.msg || `could not load visualization (status: ${source.status})`;
+    }
+}
+
+if (svg_container !== null) {
+    load_visualization();
+}
@@ -7,6 +7,10 @@ urlpatterns = [
     path(r"mockup", views.mockup, name="mockuppage"),
     path(r"search/", views.get_item, name="search"),
     path(r"api/get_auto_complete_list", views.get_auto_complete_list, name="get_auto_complete_list"),
+    path(r"api/relations/<str:uri>", views.get_relations, name="relations"),
+    path(r"api/complete", views.get_completions, name="complete"),
+    path(r"api/sparql", views.ApiSparqlView.as_view(), name="sparql_api"),
+    path(r"api/cache_stats", views.get_cache_stats, name="cache_stats"),
     path(r"api/save_file", views.ApiSaveFile.as_view(), name="save_file"),
     path(r"editor", views.EditorView.as_view(), name="show_editor"),
     re_path(r"^editor/(?P<uri>.*)$", views.EditorView.as_view(), name="show_editor_with_uri"),
@@ -14,6 +18,7 @@ urlpatterns = [
     path("sparql/", views.SearchSparqlView.as_view(), name="sparqlpage"),
     path(r"e/<str:uri>", views.entity_view, name="entitypage"),
     path(r"e/<str:uri>/v", views.entity_visualization_view, name="entityvisualization"),
+    path(r"e/<str:uri>/v/svg", views.entity_visualization_svg, name="entityvisualization_svg"),
     path(r"debug", views.debug_view, name="debugpage0"),
     path(r"debug/<int:xyz>", views.debug_view, name="debugpage_with_argument"),
 ]
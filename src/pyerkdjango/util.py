@@ -1,12 +1,25 @@
 import time
+import datetime
+import uuid
 import os
+import sys
 import itertools
+import hashlib
+import functools
+import contextlib
+import importlib.machinery
+import linecache
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
 import urllib
 import shutil
 from django.db.utils import OperationalError
 from django.conf import settings
-from django.db import transaction
-from django.urls import reverse
+from django.db import transaction, connection, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+from django.urls import reverse, get_script_prefix
+from django.utils.http import RFC3986_SUBDELIMS
 from addict import Addict as Container
 
 import pyerk
@@ -16,17 +29,58 @@ from pyerk import (  # noqa
     auxiliary as aux,
 )
 from .models import Entity, LanguageSpecifiedString as LSS
+from . import search, caching, locking, scope_index, watcher
+from .release import __version__
 
 DB_ALREADY_LOADED = False
 
+# incremented whenever the loaded pyerk data changes (used as part of cache keys, see bump_data_generation)
+DATA_GENERATION = 0
+
+# time of the last change of DATA_GENERATION (used for Last-Modified headers)
+DATA_GENERATION_TIMESTAMP = datetime.datetime.now(tz=datetime.timezone.utc)
+
+# distinguishes the data generations of different server processes (see get_data_version)
+PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+# number of rows per query for `uri__in=...`-lookups (sqlite limits the number of variables per query)
+SQL_BATCH_SIZE = 500
+
+# mapping like {uri1: pk1, ...} for all entities in the db (filled by load_erk_entities_to_db)
+URI_PK_MAP: Dict[str, int] = {}
+
+# sources of modules which are loaded from a previous version instead of the file content (because loading the file
+# content failed, see reload_modules_for_path); keys: absolute file paths
+LOADED_SOURCE_OVERRIDES: Dict[str, str] = {}
+
+# protects the loaded pyerk data: requests hold the read lock (see middleware.py), (re)loading and unloading of modules
+# needs the write lock
+DATA_LOCK = locking.ReadWriteLock()
+
+ModuleType = type(os)
+
+# data of a pyerk entity as it is stored in the database
+EntityRecord = namedtuple("EntityRecord", ["entity", "label", "description", "content_hash"])
+
 
 def reload_data_if_necessary(force: bool = False, speedup: bool = True) -> Container:
-    res = Container()
-    res.modules = reload_modules_if_necessary(force=force)
+    res = Container(modules=0)
+
+    # the write lock is only needed if something has to be loaded
+    if force or not DB_ALREADY_LOADED or modules_need_reload():
+        with DATA_LOCK.write():
+            res.modules = reload_modules_if_necessary(force=force)
+            if res.modules:
+                bump_data_generation()
+                scope_index.SCOPE_INDEX.sync()
 
-    # TODO: test if db needs to be reloaded
-    if force or not DB_ALREADY_LOADED:
-        res.db = load_erk_entities_to_db(speedup=speedup)
+            # the db is outdated if it was never loaded or if modules were (re)loaded (e.g. after unload_data with
+            # clear_db=False); the synchronization only writes the differences (see load_erk_entities_to_db)
+            if force or not DB_ALREADY_LOADED or res.modules:
+                res.db = load_erk_entities_to_db(speedup=speedup)
+
+    # changed modules are reloaded in the background (see watcher.py)
+    watcher.start_watcher_if_enabled()
 
     # n = len(Entity.objects.all())
     # n += len(LSS.objects.all())
@@ -35,13 +89,20 @@ def reload_data_if_necessary(force: bool = False, speedup: bool = True) -> Conta
     return res
 
 
+def modules_need_reload() -> bool:
+    """
+    Return True if the main module (specified in the config file) is not loaded.
+    """
+    return settings.LC.ERK_DATA_MAIN_MOD_PREFIX not in pyerk.ds.uri_prefix_mapping.b
+
+
 # TODO: a config file should specify which modules to load
 def reload_modules_if_necessary(force: bool = False) -> int:
     count = 0
 
     # load the main_module specified in the config file (erkpackage.toml)
     LC = settings.LC
-    if force or LC.ERK_DATA_MAIN_MOD_PREFIX not in pyerk.ds.uri_prefix_mapping.b:
+    if force or modules_need_reload():
         _ = pyerk.erkloader.load_mod_from_path(
             LC.ERK_DATA_MAIN_MOD, prefix=LC.ERK_DATA_MAIN_MOD_PREFIX, modname=LC.ERK_DATA_MAIN_MOD_NAME,
         )
@@ -57,56 +118,388 @@ def reload_modules_if_necessary(force: bool = False) -> int:
     return count
 
 
-def load_erk_entities_to_db(speedup: bool = True) -> int:
+def reload_modules_for_path(fpath: str, speedup: bool = True, previous_source: Optional[str] = None) -> List[str]:
+    """
+    Reload the module which was loaded from `fpath` together with all modules which depend on it (directly or
+    indirectly). All other modules are kept. Afterwards the db is synchronized only for the entities of the changed
+    modules.
+
+    Note: Modules which are loaded by a reloaded module are executed again by pyerk unless they are reused.
+
+    :param fpath:           path of the (changed) module file
+    :param speedup:         see load_erk_entities_to_db
+    :param previous_source: optional previous source of the module (see get_loaded_source); if given and loading
+                            fails, the modules are loaded again with this source instead of the file content (the file
+                            itself is not changed) before the exception is raised. Otherwise the modules which could
+                            not be loaded are removed (also from the db).
+
+    :return:                list of the uris of all modules which were unloaded or (re)loaded (empty if `fpath` does
+                            not belong to a loaded module)
+    """
+
+    fpath = os.path.abspath(fpath)
+    with DATA_LOCK.write():
+        mod_uri = pyerk.ds.mod_path_mapping.b.get(fpath)
+        if mod_uri is None:
+            return []
+
+        # dependents come before their dependencies
+        affected_mod_uris = get_dependent_mod_uris(mod_uri)
+
+        # data which is needed to load the modules again: (path, prefix, modname)
+        load_args = {
+            uri: (
+                pyerk.ds.mod_path_mapping.a[uri], pyerk.ds.uri_prefix_mapping.a[uri], pyerk.ds.modnames.get(uri)
+            )
+            for uri in affected_mod_uris
+        }
+
+        # dependents which are loaded from a previous version (see below) keep it
+        source_overrides = {
+            path: LOADED_SOURCE_OVERRIDES[path]
+            for path, _, _ in load_args.values() if path in LOADED_SOURCE_OVERRIDES and path != fpath
+        }
+
+        old_mods = dict(pyerk.ds.uri_mod_dict)
+        try:
+            for uri in affected_mod_uris:
+                pyerk.unload_mod(uri, strict=False)
+            with _override_module_sources(source_overrides):
+                _load_missing_mods(affected_mod_uris, load_args)
+            LOADED_SOURCE_OVERRIDES.pop(fpath, None)
+        except Exception:
+            if previous_source is None:
+                raise
+            # keep serving the previous version (the file keeps the failed content)
+            source_overrides[fpath] = previous_source
+            with _override_module_sources(source_overrides):
+                _load_missing_mods(affected_mod_uris, load_args)
+            LOADED_SOURCE_OVERRIDES[fpath] = previous_source
+            raise
+        finally:
+            for path in list(LOADED_SOURCE_OVERRIDES):
+                if path not in pyerk.ds.mod_path_mapping.b:
+                    LOADED_SOURCE_OVERRIDES.pop(path)
+
+            # only modules which are really gone are deleted from the db (and the index)
+            new_mods = pyerk.ds.uri_mod_dict
+            changed_mod_uris = [
+                uri for uri in {**old_mods, **new_mods} if old_mods.get(uri) is not new_mods.get(uri)
+            ]
+
+            bump_data_generation()
+            scope_index.SCOPE_INDEX.sync()
+            if DB_ALREADY_LOADED:
+                load_erk_entities_to_db(speedup=speedup, mod_uris=changed_mod_uris)
+
+            if watcher.WATCHER is not None:
+                fpaths = [pyerk.ds.mod_path_mapping.a.get(uri) for uri in changed_mod_uris]
+                watcher.WATCHER.notify_reloaded([fpath for fpath in fpaths if fpath is not None])
+
+    return changed_mod_uris
+
+
+def _load_missing_mods(mod_uris: List[str], load_args: Dict[str, Tuple[str, str, Optional[str]]]) -> None:
+    """
+    Load those of the given modules which are not loaded (see reload_modules_for_path).
+    """
+
+    missing_mod_uris = [uri for uri in mod_uris if uri not in pyerk.ds.uri_mod_dict]
+
+    # a failed attempt to load a module leaves its module object in sys.modules (this would prevent loading it again,
+    # also as dependency of another module)
+    for uri in missing_mod_uris:
+        path, prefix, modname = load_args[uri]
+        name = modname or os.path.splitext(os.path.basename(path))[0]
+        if getattr(sys.modules.get(name), "__file__", None) == path:
+            sys.modules.pop(name)
+
+    # top-most modules first: they load their dependencies themselves
+    for uri in missing_mod_uris:
+        if uri not in pyerk.ds.uri_mod_dict:
+            path, prefix, modname = load_args[uri]
+            pyerk.erkloader.load_mod_from_path(path, prefix=prefix, modname=modname)
+
+
+def get_loaded_source(fpath: str) -> str:
+    """
+    Return the source of the loaded module of `fpath`. This is the file content unless loading the file content
+    failed and the previous version of the module stays loaded (see reload_modules_for_path).
+    """
+
+    source = LOADED_SOURCE_OVERRIDES.get(os.path.abspath(fpath))
+    if source is None:
+        with open(fpath) as txtfile:
+            source = txtfile.read()
+    return source
+
+
+@contextlib.contextmanager
+def _override_module_sources(sources: Dict[str, str]):
+    """
+    Let the import system execute the given sources instead of the content of the respective files (e.g. to load the
+    previous version of a module, see reload_modules_for_path). The files are neither read nor changed.
+
+    :param sources:     dict like {absolute_fpath1: source1, ...}
     """
-    Load data from python-module into data base to allow simple searching
+
+    if not sources:
+        yield
+        return
+
+    loader_class = importlib.machinery.SourceFileLoader
+    original_get_code = loader_class.get_code
+    own_get_code = vars(loader_class).get("get_code")
+
+    def get_code(loader, fullname):
+        source = sources.get(os.path.abspath(loader.path))
+        if source is not None:
+            # note: the bytecode cache (__pycache__) is not used because it belongs to the file content
+            return compile(source, loader.path, "exec", dont_inherit=True)
+        return original_get_code(loader, fullname)
+
+    # pyerk determines the keys of new entities from the source lines of the calling frames (see linecache); entries
+    # without mtime are not replaced by the file content
+    for fpath, source in sources.items():
+        linecache.cache[fpath] = (len(source), None, source.splitlines(keepends=True), fpath)
+
+    loader_class.get_code = get_code
+    try:
+        yield
+    finally:
+        for fpath in sources:
+            linecache.cache.pop(fpath, None)
+        if own_get_code is None:
+            # the method is inherited (deleting the override restores it)
+            del loader_class.get_code
+        else:
+            loader_class.get_code = own_get_code
+
+
+def get_dependent_mod_uris(mod_uri: str) -> List[str]:
+    """
+    Return the uris of the module and all loaded modules which depend on it (directly or indirectly) such that every
+    module comes before its dependencies.
+
+    A module depends on another module if one of its global variables refers to that module (this is the case for
+    modules loaded with `pyerk.erkloader.load_mod_from_path`).
+    """
+
+    # dict like {mod_uri1: {uri of dependent module, ...}, ...}
+    dependents = {uri: set() for uri in pyerk.ds.uri_mod_dict}
+    for uri, mod in pyerk.ds.uri_mod_dict.items():
+        for obj in list(vars(mod).values()):
+            dep_uri = getattr(obj, "__URI__", None) if isinstance(obj, ModuleType) else None
+            if dep_uri in dependents and dep_uri != uri:
+                dependents[dep_uri].add(uri)
+
+    # depth first search; the reversed post-order puts dependents before their dependencies
+    res = []
+    visited = set()
+
+    def visit(uri):
+        visited.add(uri)
+        for dependent_uri in sorted(dependents.get(uri, ())):
+            if dependent_uri not in visited:
+                visit(dependent_uri)
+        res.append(uri)
+
+    visit(mod_uri)
+    return res
+
+
+def bump_data_generation() -> int:
+    """
+    Mark all data which was derived from the loaded modules (e.g. rendered html) as outdated.
+
+    :return:    new generation number
+    """
+    global DATA_GENERATION, DATA_GENERATION_TIMESTAMP
+    DATA_GENERATION += 1
+    DATA_GENERATION_TIMESTAMP = datetime.datetime.now(tz=datetime.timezone.utc)
+    caching.clear_all()
+
+    # the rdf graph is recreated on demand (see sparql.get_rdf_graph)
+    pyerk.ds.rdfgraph = None
+    return DATA_GENERATION
+
+
+def get_data_version() -> str:
+    """
+    Return a token which changes whenever the loaded data changes (used for ETags and page cache keys).
+    """
+    return f"{PROCESS_TOKEN}-{DATA_GENERATION}"
+
+
+# the content hash of the current data generation; keys: data_generation (see get_data_content_hash)
+DATA_CONTENT_HASH_CACHE = caching.LRUCache("data_content_hash", maxsize=1)
+
+
+def get_data_content_hash() -> str:
+    """
+    Return a hash which only depends on the loaded data (used for on-disk caches, see vis_integration.py). Unlike
+    get_data_version the hash is the same for all server processes and after a restart.
+
+    The hash is computed from the source files of the loaded modules. Modules without a source file (e.g. created
+    at runtime) make the hash specific to the current process and data generation.
+    """
+
+    key = DATA_GENERATION
+    res = DATA_CONTENT_HASH_CACHE.get(key)
+    if res is not None:
+        return res
+
+    with DATA_LOCK.read():
+        mod_paths = [(uri, pyerk.ds.mod_path_mapping.a.get(uri)) for uri in sorted(pyerk.ds.uri_mod_dict)]
+        n_entities = (len(pyerk.ds.items), len(pyerk.ds.relations))
+
+    hash_obj = hashlib.sha1(f"pyerk {pyerk.__version__}\npyerkdjango {__version__}\n{n_entities}\n".encode("utf8"))
+    for uri, fpath in mod_paths:
+        hash_obj.update(f"{uri}\n".encode("utf8"))
+        try:
+            with open(fpath, "rb") as binfile:
+                hash_obj.update(hashlib.sha1(binfile.read()).digest())
+        except (TypeError, OSError):
+            hash_obj.update(f"{get_data_version()}\n".encode("utf8"))
+
+    res = hash_obj.hexdigest()
+    DATA_CONTENT_HASH_CACHE.set(key, res)
+    return res
+
+
+def load_erk_entities_to_db(speedup: bool = True, mod_uris: Optional[List[str]] = None) -> Container:
+    """
+    Synchronize the database with the entities from the loaded python-modules (to allow simple searching).
+
+    Instead of deleting and recreating all rows, the in-memory pyerk entities are compared (by uri) with the rows
+    in the database. Changes of label or description are detected via `Entity.content_hash`. Only the rows which
+    differ are inserted, updated or deleted.
 
     :param speedup:     default True; flag to determine if transaction.set_autocommit(False) should be used
                         this significantly speeds up the start of the development server but does not work well
                         with django.test.TestCase (where we switch it off)
+    :param mod_uris:    optional list of module uris; if given, only the entities of these modules are synchronized
+                        (see reload_modules_for_path)
 
-    :return:            number of entities loaded
+    :return:            Container with the number of created, updated, deleted and unchanged entities
     """
 
     # TODO: delete this?
     # this was added to main (2022-09-09) but never merged to develop
     # pyerk.ackrep_parser.parse_ackrep()
 
-    # delete all existing data (if database already exisits)
+    res = Container(created=0, updated=0, deleted=0, unchanged=0)
+
+    entity_qs = Entity.objects.all()
+    if mod_uris is not None:
+        if not mod_uris:
+            return res
+        uri_filter = Q()
+        for uri_prefix in get_mod_uri_prefixes(mod_uris):
+            uri_filter |= Q(uri__startswith=uri_prefix)
+        entity_qs = entity_qs.filter(uri_filter)
+
     try:
-        Entity.objects.all().delete()
-        LSS.objects.all().delete()
+        db_rows = list(entity_qs.values_list("uri", "content_hash", "id"))
     except OperationalError:
         # db does not yet exist. The functions is probably called during `manage.py migrate` or similiar.
-        return 0
+        return res
+
+    db_hashes = {uri: chash for uri, chash, pk in db_rows}
+
+    if mod_uris is None:
+        URI_PK_MAP.clear()
+    URI_PK_MAP.update((uri, pk) for uri, chash, pk in db_rows)
 
     if settings.RUNNING_TESTS:
         speedup = False
 
-    # repopulate the databse with items and relations (and auxiliary objects)
-    _load_entities_to_db(speedup=speedup)
+    records = get_entity_records(mod_uris)
+
+    diff = Container(
+        created=[uri for uri in records if uri not in db_hashes],
+        updated=[uri for uri, chash in db_hashes.items() if uri in records and records[uri].content_hash != chash],
+        deleted=[uri for uri in db_hashes if uri not in records],
+    )
 
-    n = len(Entity.objects.all())
-    n += len(LSS.objects.all())
+    # bring the databse in sync with the items and relations (and auxiliary objects)
+    _load_entities_to_db(records, diff, speedup=speedup, mod_uris=mod_uris)
 
-    print(n, "objects loaded")
+    res.created = len(diff.created)
+    res.updated = len(diff.updated)
+    res.deleted = len(diff.deleted)
+    res.unchanged = len(records) - res.created - res.updated
 
-    global DB_ALREADY_LOADED
-    DB_ALREADY_LOADED = True
+    scope_info = "" if mod_uris is None else f" of {len(mod_uris)} module(s)"
+    print(
+        f"{len(records)} entities{scope_info} in db (created: {res.created}, updated: {res.updated}, "
+        f"deleted: {res.deleted}, unchanged: {res.unchanged})"
+    )
 
-    return n
+    if mod_uris is None:
+        global DB_ALREADY_LOADED
+        DB_ALREADY_LOADED = True
 
+    return res
 
-def _load_entities_to_db(speedup: bool) -> None:
+
+def get_entity_records(mod_uris: Optional[List[str]] = None) -> Dict[str, EntityRecord]:
+    """
+    Create a dict like {uri1: EntityRecord(...), ...} for all loaded items and relations (optionally: only for those
+    of the given modules).
+    """
+
+    uri_prefixes = get_mod_uri_prefixes(mod_uris) if mod_uris is not None else ("",)
+
+    records = {}
+    for ent in itertools.chain(pyerk.ds.items.values(), pyerk.ds.relations.values()):
+        if ent.uri.startswith(uri_prefixes):
+            records[ent.uri] = create_entity_record(ent)
+    return records
+
+
+def get_mod_uri_prefixes(mod_uris: List[str]) -> Tuple[str, ...]:
+    """
+    Return the prefixes of the entity uris of the given modules (can be passed to str.startswith).
+    """
+    return tuple(f"{mod_uri}{pyerk.settings.URI_SEP}" for mod_uri in mod_uris)
+
+
+def create_entity_record(ent: pyerk.Entity) -> EntityRecord:
+    """
+    Collect the data which is stored in the database for an entity together with a hash over this data.
+    Note: the label object is not yet commited to the database.
+
+    :param ent:
+    :return:
+    """
+    label = create_lss(ent, "R1")
+    description = getattr(ent, "R2", None)
+
+    hash_src = "\n".join((label.langtag, repr(label.content), repr(description)))
+    content_hash = hashlib.sha1(hash_src.encode("utf8")).hexdigest()
+
+    return EntityRecord(ent, label, description, content_hash)
+
+
+def _load_entities_to_db(
+    records: Dict[str, EntityRecord], diff: Container, speedup: bool, mod_uris: Optional[List[str]] = None
+) -> None:
 
     # this pattern is based on https://stackoverflow.com/a/31822405/333403
     try:
         if speedup:
             transaction.set_autocommit(False)
-        __load_entities_to_db(speedup=speedup)
+        __delete_entities_from_db(diff.deleted)
+        __update_entities_in_db([records[uri] for uri in diff.updated])
+        __load_entities_to_db([records[uri] for uri in diff.created], speedup=speedup)
+        search.get_search_engine().sync_index(records, mod_uris=mod_uris)
     except Exception:
         if speedup:
             transaction.rollback()
+
+        # the map might contain primary keys of rows which do not exist anymore
+        URI_PK_MAP.clear()
         raise
     else:
         if speedup:
@@ -116,9 +509,10 @@ def _load_entities_to_db(speedup: bool) -> None:
             transaction.set_autocommit(True)
 
 
-def __load_entities_to_db(speedup: bool) -> None:
+def __load_entities_to_db(records: List[EntityRecord], speedup: bool) -> None:
     """
 
+    :param records:   list of EntityRecord-objects for which new rows should be created
     :param speedup:   default True; determine if db-commits are switched to "manual mode" to leverage bulk operations
     :return:
     """
@@ -126,36 +520,139 @@ def __load_entities_to_db(speedup: bool) -> None:
     entity_list = []
     label_list = []
 
-    for ent in itertools.chain(pyerk.ds.items.values(), pyerk.ds.relations.values()):
-        label = create_lss(ent, "R1")
-        entity = Entity(uri=ent.uri, description=getattr(ent, "R2", None))
+    for record in records:
+        entity = Entity(uri=record.entity.uri, description=record.description, content_hash=record.content_hash)
+        entity.sort_auto, entity.sort_letter, entity.sort_num = search._entity_sort_key(record.entity)
 
-        label_list.append(label)
+        label_list.append(record.label)
         entity_list.append(entity)
 
     # print(pyerk.auxiliary.bcyan(f"time1: {time.time() - t0}"))
-    Entity.objects.bulk_create(entity_list)
-    LSS.objects.bulk_create(label_list)
+    _bulk_create(Entity, entity_list)
+    _bulk_create(LSS, label_list)
 
     if speedup:
         transaction.commit()
 
-    assert len(Entity.objects.all()) == len(LSS.objects.all()), "Mismatch in Entities and corresponding Labels."
-    for entity, label in zip(Entity.objects.all(), LSS.objects.all()):
-        entity.label.add(label)
+    _link_labels(entity_list, label_list)
+    URI_PK_MAP.update((entity.uri, entity.pk) for entity in entity_list)
 
     # print(pyerk.auxiliary.bcyan(f"time2: {time.time() - t0}"))
 
 
-def unload_data(strict=False):
+def __update_entities_in_db(records: List[EntityRecord]) -> None:
+    """
+    Update description and label of already existing rows (the primary keys of the entities are preserved).
+    """
+
+    for chunk in _chunks(records):
+        records_by_uri = {record.entity.uri: record for record in chunk}
+        uris = list(records_by_uri.keys())
+
+        # labels are not updated but replaced
+        LSS.objects.filter(entity__uri__in=uris).delete()
+
+        entity_list = list(Entity.objects.filter(uri__in=uris))
+        for entity in entity_list:
+            record = records_by_uri[entity.uri]
+            entity.description = record.description
+            entity.content_hash = record.content_hash
+
+        Entity.objects.bulk_update(entity_list, ["description", "content_hash"])
+
+        label_list = [records_by_uri[entity.uri].label for entity in entity_list]
+        _bulk_create(LSS, label_list)
+        _link_labels(entity_list, label_list)
+
+
+def __delete_entities_from_db(uris: List[str]) -> None:
+
+    for chunk in _chunks(uris):
+        pks = list(Entity.objects.filter(uri__in=chunk).values_list("id", flat=True))
+        LSS.objects.filter(entity__uri__in=chunk).delete()
+        Entity.objects.filter(uri__in=chunk).delete()
+        search.delete_db_index_rows(pks)
+
+    for uri in uris:
+        URI_PK_MAP.pop(uri, None)
+
+
+def _link_labels(entity_list: List[Entity], label_list: List[LSS]) -> None:
+    """
+    Associate every (already saved) entity with the corresponding (already saved) label.
+
+    Instead of calling `entity.label.add(label)` for every entity, all rows of the through table are created by
+    (batched) bulk inserts. This relies on the primary keys which are set by `_bulk_create`.
+    """
+
+    assert len(entity_list) == len(label_list), "Mismatch in Entities and corresponding Labels."
+
+    LabelThrough = Entity.label.through
+    through_list = [
+        LabelThrough(entity_id=entity.pk, languagespecifiedstring_id=label.pk)
+        for entity, label in zip(entity_list, label_list)
+    ]
+    LabelThrough.objects.bulk_create(through_list, batch_size=SQL_BATCH_SIZE)
+
+
+def _bulk_create(model: type, obj_list: list) -> None:
+    """
+    Insert the objects into the db and ensure that their primary keys are set afterwards.
+    """
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(obj_list, batch_size=SQL_BATCH_SIZE)
+    else:
+        # fallback for databases where bulk_create does not return the primary keys (e.g. sqlite < 3.35)
+        for obj in obj_list:
+            obj.save()
+
+
+def _chunks(seq: list, size: int = SQL_BATCH_SIZE):
+    """
+    Split a sequence into chunks such that queries like `uri__in=chunk` stay below the sql variable limit.
+    """
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def unload_data(strict=False, clear_db=True):
 
     # unload all loaded modules
-    for uri, name in pyerk.ds.modnames.items():
-        pyerk.unload_mod(uri, strict=strict)
+    with DATA_LOCK.write():
+        for uri, name in list(pyerk.ds.modnames.items()):
+            pyerk.unload_mod(uri, strict=strict)
+        LOADED_SOURCE_OVERRIDES.clear()
+
+        bump_data_generation()
+        scope_index.SCOPE_INDEX.sync()
+
+    if not clear_db:
+        # the db will be synchronized during the next call of load_erk_entities_to_db
+        return
 
     # unload db
     Entity.objects.all().delete()
     LSS.objects.all().delete()
+    search.delete_db_index_rows()
+    URI_PK_MAP.clear()
+
+
+def get_db_entity(uri: str) -> Entity:
+    """
+    Return the db entity for the given uri or raise Http404.
+
+    If `settings.USE_URI_PK_MAP` is true and the uri is contained in URI_PK_MAP, no query is performed. The returned
+    object then only contains `id` and `uri`; all other fields are deferred (i.e. loaded from the db on access).
+
+    :param uri:
+    :return:
+    """
+
+    if settings.USE_URI_PK_MAP and (pk := URI_PK_MAP.get(uri)) is not None:
+        return Entity.from_db(DEFAULT_DB_ALIAS, ["id", "uri"], [pk, uri])
+
+    return get_object_or_404(Entity, uri=uri)
 
 
 def create_lss(ent: pyerk.Entity, rel_key: str) -> LSS:
@@ -220,12 +717,17 @@ def savetxt(fpath: str, file_content: str, backup=True) -> None:
         fp.write(file_content)
 
 
-# TODO: obsolete?
+# placeholder which is used to create url templates via `reverse` (see get_url_template)
+URL_PLACEHOLDER = "__xxx__"
+
+
 def q_reverse(pagename, uri, **kwargs):
     """
     Simplifies the hazzle for passing URIs into `reverse` (they must be percent-encoded therefor, aka quoted), and then
     unqoting the result again.
 
+    For url patterns which only take the `uri`-argument the result is created from a cached url template (see
+    get_url_template) instead of calling `reverse` (which is much slower).
 
     :param pagename:
     :param uri:
@@ -233,7 +735,31 @@ def q_reverse(pagename, uri, **kwargs):
     :return:
     """
 
-    quoted_url = reverse(pagename, kwargs={"uri": urlquote(uri)})
+    if kwargs:
+        return reverse(pagename, kwargs={"uri": urlquote(uri), **kwargs})
+
+    return get_url_template(pagename).replace(URL_PLACEHOLDER, quote_uri_for_url(uri))
+
+
+def get_url_template(pagename: str) -> str:
+    """
+    Return a string like "/e/__xxx__" where the placeholder has to be replaced by the quoted uri.
+    """
+
+    # the result of `reverse` depends on the script prefix (which is set per request)
+    return _get_url_template(pagename, get_script_prefix())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_url_template(pagename: str, script_prefix: str) -> str:
+    return reverse(pagename, kwargs={"uri": URL_PLACEHOLDER})
+
+
+@functools.lru_cache(maxsize=100000)
+def quote_uri_for_url(uri: str) -> str:
+    """
+    Quote an uri like `reverse(pagename, kwargs={"uri": urlquote(uri)})` does (i.e. the uri is quoted twice).
+    """
 
     # noinspection PyUnresolvedReferences
-    return quoted_url
+    return urllib.parse.quote(urlquote(uri), safe=RFC3986_SUBDELIMS + "/~:@")
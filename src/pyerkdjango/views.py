@@ -1,19 +1,34 @@
 import os
-from typing import Union, Optional, Dict, Tuple
+import datetime
+import functools
+import itertools
+import concurrent.futures
+import hashlib
+from typing import Union, Optional, Dict, List, Tuple, Mapping
+from types import MappingProxyType
 import urllib
 import json
 from django.conf import settings
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseServerError, HttpResponseRedirect, JsonResponse
+from django.shortcuts import render
+from django.http import (
+    HttpResponse, HttpResponseServerError, HttpResponseRedirect, JsonResponse, Http404, StreamingHttpResponse
+)
 from django.template.response import TemplateResponse
 from django.template.loader import get_template
 from django.views import View
-from django.db.models import Q
+from django.views.decorators.http import condition
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
 from textwrap import dedent as twdd
-from tabulate import tabulate
+from django_bleach.templatetags.bleach_tags import bleach_value
 import pyerk
 import pyerk.rdfstack
 from . import util
+from . import search
+from . import caching
+from . import scope_index
+from . import sparql
+from . import completion
 from addict import Dict as attr_dict
 
 from ipydex import IPS
@@ -22,11 +37,57 @@ from .models import Entity
 from . import vis_integration
 
 
+def data_version_etag(request, *args, **kwargs) -> str:
+    return util.get_data_version()
+
+
+def data_version_last_modified(request, *args, **kwargs) -> datetime.datetime:
+    return util.DATA_GENERATION_TIMESTAMP
+
+
+def reloading_data_version_etag(request, *args, **kwargs) -> str:
+    # ensure that the data is loaded before the version is determined (as the view would do it)
+    util.reload_data_if_necessary()
+    return util.get_data_version()
+
+
+def cache_page_per_data_version(view_func):
+    """
+    Decorator to store the content of successful GET responses in the cache `settings.PAGE_CACHE_ALIAS`.
+    The cache key consists of the data version (see util.get_data_version) and the full path of the request.
+    Responses with `Cache-Control: no-store` (e.g. pages with a pending visualization) are not stored.
+    """
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "GET" or not settings.PAGE_CACHE_ALIAS:
+            return view_func(request, *args, **kwargs)
+
+        page_cache = caches[settings.PAGE_CACHE_ALIAS]
+        path_hash = hashlib.sha1(request.get_full_path().encode("utf8")).hexdigest()
+        key = f"page:{util.get_data_version()}:{path_hash}"
+
+        cached = page_cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view_func(request, *args, **kwargs)
+        cacheable = "no-store" not in response.get("Cache-Control", "")
+        if response.status_code == 200 and not response.streaming and cacheable:
+            page_cache.set(key, (response.content, response["Content-Type"]), settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
+
+
 def home_page_view0(request):
 
     return HttpResponse("klappt")
 
 
+@condition(etag_func=data_version_etag, last_modified_func=data_version_last_modified)
+@cache_page_per_data_version
 def home_page_view(request):
     # util.reload_data_if_necessary()
 
@@ -37,93 +98,115 @@ def home_page_view(request):
     return render(request, "mainapp/page-landing.html", context)
 
 
-def _entity_sort_key(entity) -> Tuple[str, int]:
-    """
-    Convert an short_key of an entity to a tuple which is used for sorting.
+# /search/?q=...&offset=...&limit=...
+# cache for the responses of the `/search/` view; keys like (normalized query, offset, limit, data_generation)
+SEARCH_RESULT_CACHE = caching.LRUCache(
+    "search_results", maxsize=settings.SEARCH_RESULT_CACHE_SIZE, ttl=settings.SEARCH_RESULT_CACHE_TTL
+)
 
-    (Reminder: second character is either a digit or "a" for autocreted items)
 
-    "I25" -> ("I", 25)
-    "I1200" -> ("I", 1200)      (should come after I25)
-    "Ia1100" -> ("xI", 8234)    (auto-created items should come last)
+def get_item(request):
+    """
+    Return the rendered entities which match the query `q`.
 
+    Only one page (specified by `offset` and `limit`) is rendered. The response also contains the total number
+    of matches and the offset of the next page (`null` if there are no more results).
 
-    :param entity:
-    :return:
+    Recent responses are cached for `settings.SEARCH_RESULT_CACHE_TTL` seconds.
     """
 
-    uri = entity.uri
-    mod_uri, sk = uri.split(pyerk.settings.URI_SEP)
+    q = normalize_query(request.GET.get("q") or "")
+    # util.reload_data_if_necessary()
 
-    if sk[1].isdigit():
-        num = int(sk[1:])
-        letter = sk[0]
-        # return
-    else:
-        num = int(sk[2:])
-        letter = f"x{sk[0]}"
+    offset, limit = _get_page_params(request, settings.SEARCH_PAGE_SIZE, settings.SEARCH_MAX_PAGE_SIZE)
 
-    return letter, num
+    key = (q, offset, limit, util.DATA_GENERATION)
+    content = SEARCH_RESULT_CACHE.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type="application/json")
 
+    payload = []
+    total = 0
+    if q:
+        # list of uris (ordered by relevance)
+        uris, total = search.search(q, offset=offset, limit=limit)
 
-# /search/?q=...
-def get_item(request):
+        for idx, uri in enumerate(uris, start=offset):
+            code_entity = pyerk.ds.get_entity_by_uri(uri, strict=False)
+            if code_entity is None:
+                # the index might contain entities which are not loaded anymore
+                continue
+            res = render_entity_inline(
+                code_entity, idx=idx, script_tag="script", include_description=True, highlight_text=q
+            )
+            payload.append(res)
 
-    q = request.GET.get("q")
-    # util.reload_data_if_necessary()
+    next_offset = offset + limit if offset + limit < total else None
 
-    payload = []
-    if q:
-        entities = Entity.objects.filter(
-            Q(label__content__icontains=q) | Q(uri__icontains=q) | Q(description__icontains=q)
-        )
+    response = JsonResponse(
+        {"status": 200, "data": payload, "total": total, "offset": offset, "next_offset": next_offset}
+    )
+    SEARCH_RESULT_CACHE.set(key, response.content)
+    return response
 
-        entity_list = list(entities)
-        entity_list.sort(key=_entity_sort_key)
-
-        for idx, db_entity in enumerate(entity_list):
-            db_entity: Entity
-            try:
-                res = render_entity_inline(
-                    db_entity, idx=idx, script_tag="script", include_description=True, highlight_text=q
-                )
-            except KeyError:
-                # there seemse to be a bug related to data reloading and automatic key generation
-                IPS()
-                return JsonResponse({"status": 200, "data": []})
-                raise
 
-            payload.append(res)
+def normalize_query(q: str) -> str:
+    """
+    Remove leading/trailing whitespace and collapse inner whitespace ("  a   b " -> "a b")
+    """
+    return " ".join(q.split())
+
+
+def _get_page_params(request, default_limit: int, max_limit: int) -> Tuple[int, int]:
+    """
+    Return the (sanitized) GET-parameters `offset` and `limit`
+    """
 
-    return JsonResponse({"status": 200, "data": payload})
+    offset = max(_get_int_param(request, "offset", default=0), 0)
+    limit = _get_int_param(request, "limit", default=default_limit)
+    limit = min(max(limit, 1), max_limit)
+    return offset, limit
+
+
+def _get_int_param(request, name: str, default: int) -> int:
+    try:
+        return int(request.GET.get(name, default))
+    except ValueError:
+        return default
 
 
 def mockup(request):
     util.reload_data_if_necessary()
-    db_entity = get_object_or_404(Entity, uri=pyerk.u("I5"))
+    db_entity = util.get_db_entity(pyerk.u("I5"))
     rendered_entity = render_entity_inline(db_entity, idx=23, script_tag="myscript", include_description=True)
     context = dict(greeting_message="Hello, World!", rendered_entity=rendered_entity)
 
     return render(request, "mainapp/page-mockup.html", context)
 
 
+@condition(etag_func=reloading_data_version_etag, last_modified_func=data_version_last_modified)
+@cache_page_per_data_version
 def entity_view(request, uri: Optional[str] = None, vis_options: Optional[Dict] = None):
     util.reload_data_if_necessary()
     # noinspection PyUnresolvedReferences
     uri = urllib.parse.unquote(uri)
 
-    db_entity = get_object_or_404(Entity, uri=uri)
+    db_entity = util.get_db_entity(uri)
     rendered_entity = render_entity_inline(db_entity, special_class="highlight", include_description=True)
     rendered_entity_relations = render_entity_relations(db_entity)
     # rendered_entity_context_vars = render_entity_context_vars(db_entity)
     rendered_entity_scopes = render_entity_scopes(db_entity)
 
-    rendered_vis_result = vis_integration.create_visualization(db_entity, vis_options)
-
-    # TODO: This should be done in vis_integration.create_visualization;    bookmark://vis01
-    #  or better: in visualize_entity() (called from there)
-    if rendered_vis_result:
-        rendered_vis_result = rendered_vis_result.replace(r"%", r"%25")
+    # this is None if the visualization is not yet available (then the page loads it from `vis_svg_url`)
+    try:
+        rendered_vis_result = vis_integration.create_visualization(db_entity, vis_options)
+    except vis_integration.VisualizationError:
+        # the page starts a new attempt (and displays the error if it fails again)
+        rendered_vis_result = None
+    if vis_options is not None and rendered_vis_result is None:
+        vis_svg_url = f"{util.q_reverse('entityvisualization_svg', uri)}?depth={vis_options['depth']}"
+    else:
+        vis_svg_url = None
 
     context = dict(
         rendered_entity=rendered_entity,
@@ -132,16 +215,80 @@ def entity_view(request, uri: Optional[str] = None, vis_options: Optional[Dict]
         # rendered_entity_context_vars=rendered_entity_context_vars,
         rendered_entity_scopes=rendered_entity_scopes,
         rendered_vis_result=rendered_vis_result,
+        vis_svg_url=vis_svg_url,
     )
-    return render(request, "mainapp/page-entity-detail.html", context)
+    response = render(request, "mainapp/page-entity-detail.html", context)
+    if vis_svg_url is not None:
+        # the page loads the pending visualization; it must neither be cached by the server nor by the browser
+        patch_cache_control(response, no_store=True)
+    return response
 
 
+# /e/<uri>/v?depth=...
 def entity_visualization_view(request, uri: Optional[str] = None):
-    vis_dict = {"depth": 1}
+    vis_dict = {"depth": _get_vis_depth(request)}
     return entity_view(request, uri, vis_options=vis_dict)
 
 
+# /e/<uri>/v/svg?depth=...
+def entity_visualization_svg(request, uri: str):
+    """
+    Return the svg data of the visualization or an empty response with status 202 if it is not yet available (the
+    page polls this view, see visualization.js). If the creation failed, a json response with status 500 and the error
+    message is returned.
+    """
+    util.reload_data_if_necessary()
+    # noinspection PyUnresolvedReferences
+    uri = urllib.parse.unquote(uri)
+
+    if pyerk.ds.get_entity_by_uri(uri, strict=False) is None:
+        raise Http404(f"unknown uri: {uri}")
+
+    try:
+        svg_data = vis_integration.get_svg_data(uri, depth=_get_vis_depth(request))
+    except vis_integration.VisualizationError as e:
+        return JsonResponse({"status": 500, "msg": f"could not create visualization: {str(e)}"}, status=500)
+    if svg_data is None:
+        return HttpResponse(status=202)
+
+    return HttpResponse(svg_data, content_type="image/svg+xml")
+
+
+def _get_vis_depth(request) -> int:
+    depth = _get_int_param(request, "depth", default=1)
+    return min(max(depth, 1), settings.VIS_MAX_DEPTH)
+
+
+# cache for rendered entities; keys like (uri, options, data_generation)
+RENDER_CACHE = caching.LRUCache("render_entity_inline", maxsize=settings.RENDER_CACHE_SIZE)
+
+
 def render_entity_inline(entity: Union[Entity, pyerk.Entity], **kwargs) -> str:
+    """
+    Render an entity with its inline template. The result only depends on the uri, the options (kwargs) and the loaded
+    data. Thus it is cached in RENDER_CACHE (which is cleared by util.bump_data_generation).
+    """
+
+    uri = getattr(entity, "uri", None)
+    if uri is None:
+        # literal values are not cached
+        return _render_entity_inline(entity, **kwargs)
+
+    try:
+        key = (uri, tuple(sorted(kwargs.items())), util.DATA_GENERATION)
+        hash(key)
+    except TypeError:
+        # unhashable option value
+        return _render_entity_inline(entity, **kwargs)
+
+    rendered_entity = RENDER_CACHE.get(key)
+    if rendered_entity is None:
+        rendered_entity = _render_entity_inline(entity, **kwargs)
+        RENDER_CACHE.set(key, rendered_entity)
+    return rendered_entity
+
+
+def _render_entity_inline(entity: Union[Entity, pyerk.Entity], **kwargs) -> str:
 
     # allow both models.Entity (from db) and "code-defined" pyerk.Entity
     if isinstance(entity, pyerk.Entity):
@@ -160,14 +307,15 @@ def render_entity_inline(entity: Union[Entity, pyerk.Entity], **kwargs) -> str:
         assert isinstance(entity, (str, int, float, complex))
         code_entity = entity
 
-    entity_dict = represent_entity_as_dict(code_entity)
+    # copy the (cached) read-only mapping because it is modified below
+    entity_dict = dict(represent_entity_as_dict(code_entity))
     template = get_template(entity_dict["template"])
 
     highlight_text = kwargs.pop("highlight_text", None)
 
     if highlight_text:
         new_data = {}
-        replacement_exceptions = entity_dict.get("_replacement_exceptions", [])
+        replacement_exceptions = entity_dict.get("_replacement_exceptions", ())
         for key in entity_dict.keys():
             if key.startswith("_") or key in replacement_exceptions:
                 continue
@@ -191,96 +339,140 @@ def render_entity_inline(entity: Union[Entity, pyerk.Entity], **kwargs) -> str:
     return rendered_entity
 
 
+# "direct": the entity is subject of the relation edges; "inverse": the entity is object
+RELATION_DIRECTIONS = ("direct", "inverse")
+
+
 def render_entity_relations(db_entity: Entity) -> str:
+    """
+    Render the direct and the inverse relations of an entity grouped by relation key.
 
-    # omit information which is already displayed by render_entity (label, description)
-    black_listed_keys = ["R1", "R2"]
-    uri = db_entity.uri
+    For every group only the total number and the first page of relation edges are rendered. Further pages are loaded
+    on demand (see get_relations).
 
-    # #########################################################################
-    # frist: handle direct relations (where `db_entity` is subject)
-    # #########################################################################
-
-    # dict like {"R1": [<RelationEdge 1234>, ...], "R2": [...]}
-    statements0 = pyerk.ds.statements[uri]
-
-    # create a flat list of template-friendly dicts
-    re_dict_2tuples = []
-    for rel_key, re_list in statements0.items():
-        if rel_key in black_listed_keys:
-            continue
-        for re in re_list:
-            # index 0 is the subject entity which is db_entity and thus not relevant here
-            d1 = represent_entity_as_dict(re.relation_tuple[1])
-            d2 = represent_entity_as_dict(re.relation_tuple[2])
-            re_dict_2tuples.append((d1, d2))
-
-    # #########################################################################
-    # second: handle inverse relations (where `db_entity` is object)
-    # #########################################################################
-
-    # dict like {"R4": [<RelationEdge 1234>, ...], "R8": [...]}
-    inv_statements0 = pyerk.ds.inv_statements[uri]
-
-    # create a flat list of template-friendly dicts
-    inv_re_dict_2tuples = []
-    for rel_key, inv_re_list in inv_statements0.items():
-        if rel_key in black_listed_keys:
-            continue
-        for re in inv_re_list:
-            # index 2 is the object entity of the inverse relations which is db_entity and thus not relevant here
-            d0 = represent_entity_as_dict(re.relation_tuple[0])
-            d1 = represent_entity_as_dict(re.relation_tuple[1])
-            inv_re_dict_2tuples.append((d0, d1))
-
-    # #########################################################################
-    # third: render the two lists and return
-    # #########################################################################
+    Every row is assembled from the rendered cells (see render_entity_inline and RENDER_CACHE). Thus the template is
+    rendered only once for all rows (and not once per cell).
+    """
+
+    uri = db_entity.uri
+    code_entity = pyerk.ds.get_entity_by_uri(uri)
+    page_size = settings.RELATIONS_PAGE_SIZE
+
+    ctx = {}
+    for direction in RELATION_DIRECTIONS:
+        relation_groups = []
+        for rel_key, re_list in _get_relation_edges(uri, direction).items():
+            rows = _render_relation_rows(code_entity, re_list[:page_size], direction)
+            total = len(re_list)
+            relation_groups.append(
+                {
+                    "rendered_relation": render_entity_inline(re_list[0].relation_tuple[1]),
+                    "total": total,
+                    "rendered_rows": "\n".join(rows),
+                    "next_url": _get_relations_url(uri, direction, rel_key, page_size) if total > page_size else None,
+                    "remaining": total - page_size,
+                }
+            )
+        ctx[f"{direction}_relation_groups"] = relation_groups
 
-    ctx = {
-        "main_entity": {"special_class": "highlight", **represent_entity_as_dict(pyerk.ds.get_entity_by_uri(uri))},
-        "re_dict_2tuples": re_dict_2tuples,
-        "inv_re_dict_2tuples": inv_re_dict_2tuples,
-    }
     template = get_template("mainapp/widget-entity-relations.html")
     render_result = template.render(context=ctx)
 
     return render_result
 
 
-def render_entity_scopes(db_entity: Entity) -> str:
-    code_entity = pyerk.ds.get_entity_by_uri(db_entity.uri)
-    # noinspection PyProtectedMember
+# /api/relations/<uri>?direction=...&key=...&offset=...&limit=...
+def get_relations(request, uri: str):
+    """
+    Return one page of rendered relation edges of an entity for one relation key (see RELATION_DIRECTIONS).
+
+    The response contains the rendered rows, the total number of edges and the offset of the next page (`null` if
+    there are no more edges).
+    """
 
-    scopes = pyerk.get_scopes(code_entity)
+    util.reload_data_if_necessary()
+    # noinspection PyUnresolvedReferences
+    uri = urllib.parse.unquote(uri)
 
-    scope_contents = []
-    for scope in scopes:
+    code_entity = pyerk.ds.get_entity_by_uri(uri, strict=False)
+    if code_entity is None:
+        raise Http404(f"unknown uri: {uri}")
+
+    direction = request.GET.get("direction", "inverse")
+    if direction not in RELATION_DIRECTIONS:
+        return JsonResponse({"status": 400, "data": [], "msg": f"invalid direction: {direction}"}, status=400)
+
+    offset, limit = _get_page_params(request, settings.RELATIONS_PAGE_SIZE, settings.RELATIONS_MAX_PAGE_SIZE)
+
+    re_list = _get_relation_edges(uri, direction).get(request.GET.get("key"), [])
+    rows = _render_relation_rows(code_entity, re_list[offset:offset + limit], direction)
+
+    # the rows are inserted as they are (see relations.js); the rows of the detail page are bleached by the template
+    rows = [bleach_value(row) for row in rows]
+
+    total = len(re_list)
+    next_offset = offset + limit if offset + limit < total else None
 
-        # #### first: handle "variables" (locally relevant items) defined in this scope
+    return JsonResponse({"status": 200, "data": rows, "total": total, "offset": offset, "next_offset": next_offset})
 
-        items = pyerk.get_items_defined_in_scope(scope)
-        re: pyerk.RelationEdge
-        # currently we only use `R4__instance_of` as "defining relation"
-        # statements = [re for key, re_list in statements0.items() if key not in black_listed_keys for re in re_list]
-        defining_relation_triples = []
-        for item in items:
-            for re in pyerk.ds.statements[item.short_key]["R4"]:
-                defining_relation_triples.append(list(map(represent_entity_as_dict, re.relation_tuple)))
 
-        # #### second: handle further relation triples in this scope
+def _get_relation_edges(uri: str, direction: str) -> Dict[str, list]:
+    """
+    :return:    dict like {"R4": [<RelationEdge 1234>, ...], "R8": [...]}
+    """
+
+    # omit information which is already displayed by render_entity (label, description)
+    black_listed_keys = ["R1", "R2"]
+
+    if direction == "direct":
+        statements0 = pyerk.ds.statements[uri]
+    else:
+        statements0 = pyerk.ds.inv_statements[uri]
+
+    return {
+        rel_key: re_list for rel_key, re_list in statements0.items() if re_list and rel_key not in black_listed_keys
+    }
+
 
-        statement_relations = []
-        re: pyerk.RelationEdge
-        for re in pyerk.ds.scope_statements[scope.short_key]:
-            dict_tup = tuple(represent_entity_as_dict(elt) for elt in re.relation_tuple)
-            statement_relations.append(dict_tup)
+def _render_relation_rows(code_entity: pyerk.Entity, re_list: list, direction: str) -> List[str]:
 
+    rendered_main_entity = render_entity_inline(code_entity, special_class="highlight", omit_label=True)
+
+    rows = []
+    for re in re_list:
+        if direction == "direct":
+            # index 0 is the subject entity which is the main entity
+            cells = (rendered_main_entity, *map(render_entity_inline, re.relation_tuple[1:]))
+        else:
+            # index 2 is the object entity of the inverse relations which is the main entity
+            cells = (*map(render_entity_inline, re.relation_tuple[:2]), rendered_main_entity)
+        cells = "\n".join(cells)
+        rows.append(f'<li class="entity-relation-edge">\n{cells}\n</li>')
+
+    return rows
+
+
+def _get_relations_url(uri: str, direction: str, rel_key: str, offset: int) -> str:
+    # noinspection PyUnresolvedReferences
+    query = urllib.parse.urlencode({"direction": direction, "key": rel_key, "offset": offset})
+    return f"{util.q_reverse('relations', uri)}?{query}"
+
+
+def render_entity_scopes(db_entity: Entity) -> str:
+    code_entity = pyerk.ds.get_entity_by_uri(db_entity.uri)
+
+    # the scopes are precomputed when the modules are loaded (see scope_index.py)
+    scope_contents = []
+    for scope_data in scope_index.SCOPE_INDEX.get_scopes(code_entity):
         scope_contents.append(
             {
-                "name": scope.R1,
-                "defining_relations": defining_relation_triples,
-                "statement_relations": statement_relations,
+                "name": scope_data.name,
+                "defining_relations": [
+                    tuple(map(represent_entity_as_dict, tup)) for tup in scope_data.defining_relations
+                ],
+                "statement_relations": [
+                    tuple(map(represent_entity_as_dict, tup)) for tup in scope_data.statement_relations
+                ],
             }
         )
 
@@ -292,7 +484,30 @@ def render_entity_scopes(db_entity: Entity) -> str:
     return render_result
 
 
-def represent_entity_as_dict(code_entity: Union[Entity, object]) -> dict:
+# cache for the dict-representations of entities; keys like (uri, data_generation)
+ENTITY_DICT_CACHE = caching.LRUCache("represent_entity_as_dict", maxsize=settings.ENTITY_DICT_CACHE_SIZE)
+
+
+def represent_entity_as_dict(code_entity: Union[Entity, object]) -> Mapping:
+    """
+    Return the data which is used to render an entity (or a literal value).
+
+    The result for pyerk entities is cached (per data generation, see ENTITY_DICT_CACHE). Thus it is returned as
+    read-only mapping. Callers which need to modify the data have to create a copy (`dict(res)`).
+    """
+
+    if not isinstance(code_entity, pyerk.Entity):
+        return MappingProxyType(_represent_entity_as_dict(code_entity))
+
+    key = (code_entity.uri, util.DATA_GENERATION)
+    res = ENTITY_DICT_CACHE.get(key)
+    if res is None:
+        res = MappingProxyType(_represent_entity_as_dict(code_entity))
+        ENTITY_DICT_CACHE.set(key, res)
+    return res
+
+
+def _represent_entity_as_dict(code_entity: Union[Entity, object]) -> dict:
 
     if isinstance(code_entity, pyerk.Entity):
 
@@ -310,7 +525,7 @@ def represent_entity_as_dict(code_entity: Union[Entity, object]) -> dict:
             "description": str(code_entity.R2),
             "detail_url": util.q_reverse("entitypage", uri=code_entity.uri),
             "template": "mainapp/widget-entity-inline.html",
-            "_replacement_exceptions": _replacement_exceptions,
+            "_replacement_exceptions": tuple(_replacement_exceptions),
         }
     else:
         # assume we have a literal
@@ -332,7 +547,8 @@ def reload_data_redirect(request, targeturl=None):
     """
     if targeturl is None:
         targeturl = "/"
-    util.unload_data(strict=False)
+    # keep the db: after reloading the modules it is synchronized incrementally
+    util.unload_data(strict=False, clear_db=False)
     util.reload_data_if_necessary(force=True)
 
     return HttpResponseRedirect(targeturl)
@@ -340,29 +556,122 @@ def reload_data_redirect(request, targeturl=None):
 
 # this was taken from ackrep
 class SearchSparqlView(View):
+    """
+    Display the results of a SPARQL query as html table.
+
+    Only one page of rows (specified by `offset` and `limit`) is rendered. Only the rows up to this page are evaluated
+    (see sparql.SparqlResult). The page is streamed: the rows are rendered (and bleached) one by one while the response
+    is sent.
+    """
     # util.reload_data_if_necessary()
 
+    # placeholder in the rendered template where the rows are inserted
+    rows_marker = "<!-- utc_sparql_rows -->"
+
     def get(self, request):
         context = {}
         c = attr_dict()
 
         example_query = twdd(pyerk.rdfstack.get_sparql_example_query())
         qsrc = context["query"] = request.GET.get("query", example_query)
+        offset, limit = _get_page_params(request, settings.SPARQL_PAGE_SIZE, settings.SPARQL_MAX_PAGE_SIZE)
 
         try:
-            tmp_results = pyerk.rdfstack.perform_sparql_query(qsrc)
-            sparql_vars = [str(v) for v in tmp_results.vars]
-            c.results = pyerk.aux.apply_func_to_table_cells(render_entity_inline, tmp_results)
-        except pyerk.rdfstack.ParseException as e:
-            context["err"] = f"The following error occurred: {type(e).__name__}: {str(e)}"
-            c.results = []
-            sparql_vars = []
+            # the query and the result are cached (see sparql.py)
+            tmp_results = sparql.perform_sparql_query(qsrc)
+        except sparql.InvalidQueryError as e:
+            context["err"] = f"The following error occurred: {str(e)}"
+            tmp_results = sparql.SparqlResult((), [])
+
+        c.sparql_vars = tmp_results.vars
+        rows = tmp_results.get_rows(offset, limit)
+        c.first_row = offset + 1
+        c.last_row = offset + len(rows)
+
+        has_more_rows = tmp_results.has_more_rows(offset + limit)
+        # the total number is only known if all rows have been evaluated
+        c.total = tmp_results.get_total()
+
+        if has_more_rows:
+            # noinspection PyUnresolvedReferences
+            query = urllib.parse.urlencode({"query": qsrc, "offset": offset + limit, "limit": limit})
+            c.more_url = f"{request.path}?{query}"
+
+        c.rows_marker = self.rows_marker
+        context["c"] = c  # this could be used for further options
 
-        c.tab = tabulate(c.results, headers=sparql_vars, tablefmt="unsafehtml")
+        rendered_page = get_template("mainapp/page-sparql.html").render(context, request)
+        # note: the marker is missing if there is no table (e.g. due to an error)
+        head, _, tail = rendered_page.partition(self.rows_marker)
 
-        context["c"] = c  # this could be used for further options
+        return StreamingHttpResponse(itertools.chain([head], self.iter_rendered_rows(rows), [tail]))
+
+    @staticmethod
+    def iter_rendered_rows(rows: List[tuple]):
 
-        return TemplateResponse(request, "mainapp/page-sparql.html", context)
+        # dict like {rendered_entity1: bleached_rendered_entity1, ...} (many cells contain the same entities)
+        bleached_cells = {}
+
+        for row in sparql.iter_pyerk_rows(rows):
+            cells = []
+            for cell in row:
+                rendered_cell = render_entity_inline(cell)
+                bleached_cell = bleached_cells.get(rendered_cell)
+                if bleached_cell is None:
+                    bleached_cell = bleached_cells[rendered_cell] = bleach_value(rendered_cell)
+                cells.append(f"<td>{bleached_cell}</td>")
+            yield f"<tr>{''.join(cells)}</tr>\n"
+
+
+# /api/sparql?query=...&format=...&labels=...&offset=...&limit=...&timeout=...
+class ApiSparqlView(View):
+    """
+    Return the result of a SPARQL query in a machine-readable format (see sparql.OUTPUT_FORMATS); the response is
+    streamed. Entities are represented by their uris (and optionally by their labels, parameter `labels=1`).
+
+    Invalid queries result in status 400, timeouts in status 504. A timed out query can not be interrupted; while all
+    workers are busy new queries are rejected with status 503.
+    """
+
+    def get(self, request):
+        util.reload_data_if_necessary()
+
+        qsrc = request.GET.get("query")
+        output_format = request.GET.get("format", "json")
+        if not qsrc:
+            return JsonResponse({"status": 400, "msg": "missing parameter: query"}, status=400)
+        if output_format not in sparql.OUTPUT_FORMATS:
+            return JsonResponse({"status": 400, "msg": f"invalid format: {output_format}"}, status=400)
+
+        labels = request.GET.get("labels", "0").lower() in ("1", "true", "yes")
+        offset, limit = _get_page_params(request, settings.SPARQL_API_MAX_ROWS, settings.SPARQL_API_MAX_ROWS)
+        try:
+            timeout = float(request.GET.get("timeout", settings.SPARQL_API_TIMEOUT))
+        except ValueError:
+            timeout = settings.SPARQL_API_TIMEOUT
+        timeout = min(max(timeout, 0.1), settings.SPARQL_API_MAX_TIMEOUT)
+
+        try:
+            # the rows of the requested page (and one more row to determine if the result is complete)
+            res = sparql.perform_sparql_query_with_timeout(qsrc, timeout=timeout, n_rows=offset + limit + 1)
+        except sparql.InvalidQueryError as e:
+            return JsonResponse({"status": 400, "msg": str(e)}, status=400)
+        except sparql.WorkersBusyError as e:
+            response = JsonResponse({"status": 503, "msg": f"{str(e)}, please retry later"}, status=503)
+            response["Retry-After"] = int(settings.SPARQL_API_TIMEOUT)
+            return response
+        except concurrent.futures.TimeoutError:
+            return JsonResponse({"status": 504, "msg": f"query timeout ({timeout} s)"}, status=504)
+
+        rows = res.get_rows(offset, limit)
+        response = StreamingHttpResponse(
+            sparql.iter_serialized_result(res, rows, output_format, labels),
+            content_type=sparql.OUTPUT_FORMATS[output_format],
+        )
+        total = res.get_total()
+        if total is not None:
+            response["X-Total-Count"] = total
+        return response
 
 
 class EditorView(View):
@@ -410,8 +719,22 @@ class ApiSaveFile(View):
         file_content = post_data.get("editor_content")
         fpath = post_data.get("fpath")
 
+        # only the files of loaded modules can be saved
+        if not isinstance(fpath, str) or pyerk.ds.mod_path_mapping.b.get(os.path.abspath(fpath)) is None:
+            msg = f"invalid fpath: `{fpath}` is not the path of a loaded module"
+            return JsonResponse({"status": 400, "data": {"msg": msg}}, status=400)
+
+        previous_source = util.get_loaded_source(fpath)
         util.savetxt(fpath, file_content, backup=True)
 
+        # reload only the module of this file and its dependents (this also invalidates the caches); if this fails
+        # the file is kept but the modules of the previous file content stay loaded
+        try:
+            util.reload_modules_for_path(fpath, previous_source=previous_source)
+        except Exception as e:
+            msg = f"file saved but reloading failed (the previous version stays loaded): {type(e).__name__}: {str(e)}"
+            return JsonResponse({"status": 400, "data": {"msg": msg}}, status=400)
+
         return HttpResponseRedirect(f"{request.path}?success=True")
 
 
@@ -421,22 +744,42 @@ def get_auto_complete_list(request):
     Generate a list of strings which can be used in the auto-complete function of the web editor.
     This list consists mostly of short keys and indexed-keys and
 
+    Note: the web editor uses the ranked completions of /api/complete instead.
     """
-    all_entities = [*pyerk.ds.relations.values(), *pyerk.ds.items.values()]
-    completion_suggestions = []
-    for entity in all_entities:
 
-        # TODO: implement a more elegant way to exclude auxiliary items
-        if entity.short_key[1] == "a":
-            continue
+    completion_suggestions = [suggestion for _, suggestion in completion.iter_suggestions()]
+    return JsonResponse({"status": 200, "data": completion_suggestions})
 
-        completion_suggestions.append(entity.short_key)
-        completion_suggestions.append(f'{entity.short_key}["{entity.R1}"]')
-        if isinstance(entity, pyerk.Relation):
-            underscore_r1 = entity.R1.replace(" ", "_")
-            completion_suggestions.append(f"{entity.short_key}__{underscore_r1}")
 
-    return JsonResponse({"status": 200, "data": completion_suggestions})
+# /api/complete?prefix=...&limit=...
+def get_completions(request):
+    """
+    Return the most used suggestions which start with `prefix` (see completion.py). The flag `truncated` indicates that
+    there are further matches (i.e. the client has to fetch the suggestions again if the prefix is extended).
+    """
+    util.reload_data_if_necessary()
+
+    prefix = request.GET.get("prefix", "")
+    try:
+        limit = int(request.GET.get("limit", settings.COMPLETION_LIMIT))
+    except ValueError:
+        limit = settings.COMPLETION_LIMIT
+    limit = min(max(limit, 1), settings.COMPLETION_MAX_LIMIT)
+
+    # one more suggestion than requested to determine if the list is truncated
+    suggestions = completion.complete(prefix, limit + 1)
+    data = [{"value": suggestion, "score": count} for suggestion, count in suggestions[:limit]]
+    return JsonResponse({"status": 200, "data": data, "truncated": len(suggestions) > limit})
+
+
+# /api/cache_stats
+def get_cache_stats(request):
+    """
+    Return the size and the hit/miss counters of all in-process caches (see caching.py).
+    """
+
+    data = {"data_generation": util.DATA_GENERATION, "caches": caching.get_stats()}
+    return JsonResponse({"status": 200, "data": data})
 
 
 def debug_view(request, xyz=0):
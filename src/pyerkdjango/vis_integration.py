@@ -1,20 +1,333 @@
 """
 This module contains code to integrate visualization of ERK-entities into the web application.
+
+Creating a visualization (graph layout) is slow. Thus the svg data is stored in an on-disk cache
+(`settings.VIS_CACHE_DIR`). The cache contains one subdirectory per content hash of the loaded data (see
+util.get_data_content_hash), i.e. it is shared by all server processes and reused after a restart. Directories which
+were not used for `settings.VIS_CACHE_MAX_AGE` seconds are removed (see prune_cache). Missing visualizations are
+created by a pool of worker threads while the page polls for the result (see static/mainapp/visualization.js).
 """
 
-from typing import Union
+import os
+import time
+import subprocess
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Optional, Tuple
 
-from django.urls import reverse
+import networkx as nx
+import nxv
+from django.conf import settings
 from ipydex import IPS, activate_ips_on_exception
 
+import pyerk
 from pyerk import visualization
 
+from . import util
+from . import caching
+
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=settings.VIS_WORKERS, thread_name_prefix="pyerkdjango-vis")
+
+# dict like {fpath1: <Future>, ...} for all visualizations which are currently created
+_PENDING: Dict[str, Future] = {}
+_LOCK = threading.Lock()
+
+# serializes the access to the global state of pyerk.visualization
+_GRAPH_LOCK = threading.Lock()
 
-def create_visualization(db_entity, vis_options: dict) -> Union[None, str]:
+# the cache directory of the current data generation; keys like (data_generation, settings.VIS_CACHE_DIR)
+CACHE_DIR_CACHE = caching.LRUCache("vis_cache_dir", maxsize=1)
+
+
+class VisualizationError(Exception):
+    pass
+
+
+def create_visualization(db_entity, vis_options: dict) -> Optional[str]:
+    """
+    Return the (cached) visualization of an entity or None if it is not (yet) available. In the latter case the
+    visualization is created in the background (see get_svg_data).
+    """
     if vis_options is None:
         return None
 
-    url_template = reverse("entityvisualization", kwargs=dict(uri="__xxx__")).replace("__xxx__", "{quoted_uri}")
-    svg_data = visualization.visualize_entity(db_entity.uri, url_template=url_template)
+    return get_svg_data(db_entity.uri, vis_options.get("depth", 1))
+
+
+def get_svg_data(uri: str, depth: int = 1, wait: bool = False) -> Optional[str]:
+    """
+    Return the svg data from the cache. For a cache miss, the creation is started (if necessary) and None is returned.
+
+    :param uri:     entity uri
+    :param depth:   depth of the visualized neighbourhood
+    :param wait:    flag whether to wait for the result in case of a cache miss (always true during unittests)
+
+    :raises VisualizationError: if the creation failed (reported once, the next call starts a new attempt)
+    """
+
+    # this must happen in the request thread (the script prefix is thread-specific)
+    url_template = get_url_template(depth)
+
+    fpath = get_cache_path(uri, depth, url_template)
+    if os.path.isfile(fpath):
+        with open(fpath) as txtfile:
+            return txtfile.read()
+
+    with _LOCK:
+        future = _PENDING.get(fpath)
+        if future is not None and future.done():
+            # the creation failed (otherwise the file would exist): report the exception (once)
+            _PENDING.pop(fpath)
+        elif future is None:
+            future = _PENDING[fpath] = _EXECUTOR.submit(_create_svg_file, uri, depth, url_template, fpath)
+
+    if not (wait or settings.RUNNING_TESTS or future.done()):
+        return None
+
+    try:
+        return future.result()
+    except Exception as e:
+        with _LOCK:
+            if _PENDING.get(fpath) is future:
+                _PENDING.pop(fpath)
+        raise VisualizationError(f"{type(e).__name__}: {str(e)}") from e
+
+
+def _create_svg_file(uri: str, depth: int, url_template: str, fpath: str) -> str:
+    svg_data = visualize_entity(uri, depth, url_template=url_template)
+
+    # the urls in the svg data are quoted once more because the data is served as-is    bookmark://vis01
+    svg_data = svg_data.replace(r"%", r"%25")
+    svg_data = f"<!-- utc_visualization_of_{uri} --> \n{svg_data}"
+
+    util.mkdir_p(os.path.dirname(fpath))
+    # write to a temporary file first such that readers never see incomplete data
+    tmp_fpath = f"{fpath}.{threading.get_ident()}.tmp"
+    with open(tmp_fpath, "w") as txtfile:
+        txtfile.write(svg_data)
+    os.replace(tmp_fpath, fpath)
+
+    # note: in case of an exception the future remains pending until the error is reported (see get_svg_data)
+    with _LOCK:
+        _PENDING.pop(fpath, None)
+
+    return svg_data
+
+
+def get_url_template(depth: int) -> str:
+    """
+    Return the template for the urls of the nodes (must be called in the request thread because the script prefix is
+    thread-specific).
+    """
+
+    url_template = util.get_url_template("entityvisualization").replace(util.URL_PLACEHOLDER, "{quoted_uri}")
+    if depth > 1:
+        # the links keep the depth
+        url_template = f"{url_template}?depth={depth}"
+    return url_template
+
+
+def get_cache_path(uri: str, depth: int, url_template: Optional[str] = None) -> str:
+    if url_template is None:
+        url_template = get_url_template(depth)
+
+    # the budgets and the urls also influence the result
+    budgets = (settings.VIS_MAX_NODES, settings.VIS_MAX_EDGES, settings.VIS_TIME_BUDGET)
+    fname = hashlib.sha1(f"{uri}\n{depth}\n{budgets}\n{url_template}".encode("utf8")).hexdigest()
+    return os.path.join(get_cache_dir(), f"{fname}.svg")
+
+
+def get_cache_dir() -> str:
+    """
+    Return the cache directory for the loaded data (it is created and marked as used once per data generation).
+    """
+
+    key = (util.DATA_GENERATION, settings.VIS_CACHE_DIR)
+    cache_dir = CACHE_DIR_CACHE.get(key)
+    if cache_dir is None:
+        cache_dir = os.path.join(settings.VIS_CACHE_DIR, util.get_data_content_hash())
+        util.mkdir_p(cache_dir)
+        # the modification time of the directory serves as time of the last use (see prune_cache)
+        os.utime(cache_dir)
+        prune_cache(keep=cache_dir)
+        CACHE_DIR_CACHE.set(key, cache_dir)
+    return cache_dir
+
+
+def prune_cache(keep: str) -> None:
+    """
+    Remove the directories which were not used for `settings.VIS_CACHE_MAX_AGE` seconds (by any server process).
+    """
+
+    now = time.time()
+    for dirname in os.listdir(settings.VIS_CACHE_DIR):
+        path = os.path.join(settings.VIS_CACHE_DIR, dirname)
+        if path == keep or not os.path.isdir(path):
+            continue
+        try:
+            if now - os.path.getmtime(path) > settings.VIS_CACHE_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            # the directory was removed by another process
+            pass
+
+
+def visualize_entity(uri: str, depth: int = 1, url_template: str = "") -> str:
+    """
+    Create the svg data for the neighbourhood of an entity (up to `depth` relation edges away).
+
+    The graph is limited by `settings.VIS_MAX_NODES`, `settings.VIS_MAX_EDGES` and `settings.VIS_TIME_BUDGET` (see
+    create_nx_graph). For depth 1 within these budgets the result is the same as `pyerk.visualization.visualize_entity`.
+    """
+
+    # the creation of the graph uses global state of pyerk.visualization (key generators, REPLACEMENTS); it reads the
+    # loaded data (this usually runs in a worker thread, i.e. it is not protected by the read lock of the request)
+    with _GRAPH_LOCK, util.DATA_LOCK.read():
+        G, truncated = create_nx_graph(uri, depth, url_template)
+
+        raw_dot_data = visualization.render_graph_to_dot(G)
+
+        dot_data0 = raw_dot_data
+        for old, new in visualization.NEWLINE_REPLACEMENTS:
+            dot_data0 = dot_data0.replace(old, new)
+
+        # work arround curly braces in first and last line
+        dot_lines = dot_data0.split("\n")
+        inner_dot_code = "\n".join(dot_lines[1:-1])
+
+        dot_data = "\n".join((dot_lines[0], inner_dot_code, dot_lines[-1]))
+
+    # this is the expensive part (graph layout)
+    raw_svg_data = run_graphviz_layout(dot_data)
+
+    with _GRAPH_LOCK:
+        svg_data = raw_svg_data.decode("utf8").format(**visualization.REPLACEMENTS)
+
+    if truncated:
+        svg_data = f"<!-- utc_visualization_truncated --> \n{svg_data}"
+    return svg_data
+
+
+def run_graphviz_layout(dot_data: str) -> bytes:
+    """
+    Run the graphviz layout (`dot`) and return the svg data. Unlike `nxv._graphviz.run` the graphviz process is
+    killed after `settings.VIS_LAYOUT_TIMEOUT` seconds.
+    """
+
+    # noinspection PyUnresolvedReferences,PyProtectedMember
+    algorithm_path = nxv._graphviz.get_graphviz_algorithm_path(None, "dot")
+    try:
+        res = subprocess.run(
+            [algorithm_path, "-Tsvg"], input=dot_data.encode("utf8"), capture_output=True,
+            timeout=settings.VIS_LAYOUT_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        raise VisualizationError(f"graph layout timeout ({settings.VIS_LAYOUT_TIMEOUT} s)")
+
+    if res.returncode != 0:
+        raise nxv.GraphVizError(res.stderr.decode("utf8"))
+    return res.stdout
+
+
+def create_nx_graph(uri: str, depth: int, url_template: str) -> Tuple[nx.DiGraph, bool]:
+    """
+    Create the graph of the neighbourhood of an entity by breadth first search.
+
+    If a budget is exceeded the search stops and a marker node is added. Relation edges of each entity are added in
+    the order given by `settings.VIS_RELATION_PRIORITY` (i.e. the least important edges are pruned first). Note:
+    `settings.VIS_TIME_BUDGET` only limits the graph creation; the layout is limited by `settings.VIS_LAYOUT_TIMEOUT`
+    (see run_graphviz_layout).
+
+    :return:    2-tuple: (graph, truncated-flag)
+    """
+
+    entity = pyerk.ds.get_entity_by_uri(uri)
+    re_list = _get_sorted_relation_edges(entity)
+    if depth == 1 and len(re_list) <= min(settings.VIS_MAX_EDGES, settings.VIS_MAX_NODES - 1):
+        return visualization.create_nx_graph_from_entity(uri, url_template), False
+
+    t_stop = time.time() + settings.VIS_TIME_BUDGET
+
+    G = visualization.CustomizedDiGraph()
+    base_node = visualization.create_node(entity, url_template)
+    G.add_node(base_node, color="#2ca02c")
+
+    # dict like {uri1: <EntityNode>, ...}
+    nodes = {uri: base_node}
+    # set like {(subject_uri, predicate_uri, object_uri), ...} (see _get_edge_key)
+    added_relation_edges = set()
+    truncated = False
+
+    frontier = [(entity, re_list)]
+    for level in range(depth):
+        next_frontier = []
+        for current_entity, re_list in frontier:
+            if truncated:
+                break
+            for re in re_list:
+                # the same statement occurs in the relation edges of the subject and (inverse) of the object
+                edge_key = _get_edge_key(re)
+                if edge_key in added_relation_edges:
+                    continue
+                if len(added_relation_edges) >= settings.VIS_MAX_EDGES or time.time() > t_stop:
+                    truncated = True
+                    break
+
+                subj, pred, obj = re.relation_tuple
+                is_subject = re.role == pyerk.RelationRole.SUBJECT
+                other = obj if is_subject else subj
+
+                if isinstance(other, pyerk.Entity) and other.uri in nodes:
+                    other_node = nodes[other.uri]
+                elif G.number_of_nodes() >= settings.VIS_MAX_NODES:
+                    truncated = True
+                    continue
+                else:
+                    other_node = visualization.create_node(other, url_template)
+                    G.add_node(other_node)
+                    if isinstance(other, pyerk.Entity):
+                        nodes[other.uri] = other_node
+                        next_frontier.append(other)
+
+                edge = visualization.Edge(pred, url_template)
+                edge.perform_html_wrapping()
+                current_node = nodes[current_entity.uri]
+                if is_subject:
+                    G.add_edge(current_node, other_node, label=edge.get_dot_label())
+                else:
+                    G.add_edge(other_node, current_node, label=edge.get_dot_label())
+                added_relation_edges.add(edge_key)
+
+        # relation edges of the next level are only determined if they are needed
+        frontier = [(ent, _get_sorted_relation_edges(ent)) for ent in next_frontier] if level + 1 < depth else []
+
+    if truncated:
+        G.add_node(visualization.create_node("(truncated)", url_template), color="red")
+
+    return G, truncated
+
+
+def _get_edge_key(re) -> tuple:
+    """
+    Return a key which is the same for all relation edge objects of the same statement.
+    """
+
+    return tuple(getattr(elt, "uri", None) or ("literal", repr(elt)) for elt in re.relation_tuple)
+
+
+def _get_sorted_relation_edges(entity: pyerk.Entity) -> list:
+    priorities = {rel_key: i for i, rel_key in enumerate(settings.VIS_RELATION_PRIORITY)}
+
+    res = []
+    for re_dict in (entity.get_relations(), entity.get_inv_relations()):
+        for rel_key, re_list in re_dict.items():
+            if rel_key in visualization.REL_BLACKLIST:
+                continue
+            res.extend(re_list)
 
-    return f"<!-- utc_visualization_of_{db_entity.uri} --> \n{svg_data}"
+    # note: sorting is stable (the order of pyerk is kept for relations with the same priority)
+    res.sort(key=lambda re: priorities.get(re.relation_tuple[1].short_key, len(priorities)))
+    return res
@@ -0,0 +1,257 @@
+"""
+This module contains a watcher which reloads changed erk modules automatically (see util.reload_modules_for_path).
+
+The watcher tracks the files of all loaded modules (`pyerk.ds.mod_path_mapping`). Changes are detected via inotify if
+the optional package `inotify_simple` is installed, otherwise by polling the modification times. A file only counts
+as changed if its content hash differs. Bursts of changes (e.g. several files saved at once) are coalesced: the reload
+starts after `settings.WATCHER_DEBOUNCE_DELAY` seconds without further changes. The reload runs in the background
+thread of the watcher.
+"""
+
+import os
+import time
+import select
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+import pyerk
+
+from . import util
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+logger = logging.getLogger(__name__)
+
+# the watcher of this process (see start_watcher_if_enabled)
+WATCHER: Optional["ModuleFileWatcher"] = None
+_START_LOCK = threading.Lock()
+
+
+class ModuleFileWatcher:
+
+    def __init__(self, poll_interval: Optional[float] = None, debounce_delay: Optional[float] = None):
+        """
+        :param poll_interval:   seconds between two checks of the files (without inotify)
+        :param debounce_delay:  seconds without further changes after which the reload starts
+        """
+        self.poll_interval = poll_interval if poll_interval is not None else settings.WATCHER_POLL_INTERVAL
+        self.debounce_delay = debounce_delay if debounce_delay is not None else settings.WATCHER_DEBOUNCE_DELAY
+
+        # dict like {fpath1: (mtime, size, content_hash), ...} for the files of all loaded modules
+        self.file_states: Dict[str, Tuple[float, int, str]] = {}
+
+        # changed files which are not yet reloaded and time of the last detected change
+        self.pending_fpaths = set()
+        self.last_change_time = 0.0
+
+        # protects file_states and pending_fpaths (see notify_reloaded)
+        self.lock = threading.RLock()
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._inotify = inotify_simple.INotify() if inotify_simple is not None else None
+        # pipe (read_fd, write_fd) which wakes up _wait when the watcher is stopped (only needed for inotify)
+        self._wakeup_fds = os.pipe() if self._inotify is not None else None
+        # dict like {dirpath1: watch_descriptor1, ...}
+        self._watched_dirs: Dict[str, int] = {}
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="pyerkdjango-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the thread and close the inotify file descriptor.
+
+        Note: a running reload is finished first, i.e. the caller must not hold the data lock (see util.DATA_LOCK).
+        """
+
+        self._stop_event.set()
+        if self._wakeup_fds is not None:
+            os.write(self._wakeup_fds[1], b"\0")
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            for fd in self._wakeup_fds:
+                os.close(fd)
+            self._wakeup_fds = None
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.sync_tracked_files()
+
+                fpaths = []
+                timeout = self.poll_interval
+                with self.lock:
+                    changed_fpaths = self.get_changed_files()
+                    if changed_fpaths:
+                        self.pending_fpaths.update(changed_fpaths)
+                        self.last_change_time = time.monotonic()
+
+                    if self.pending_fpaths:
+                        remaining = self.last_change_time + self.debounce_delay - time.monotonic()
+                        if remaining <= 0:
+                            fpaths, self.pending_fpaths = sorted(self.pending_fpaths), set()
+                        else:
+                            timeout = min(timeout, remaining)
+
+                if fpaths:
+                    try:
+                        self.reload_files(fpaths)
+                    finally:
+                        # this thread is not managed by django (i.e. its connections are not closed automatically)
+                        connections.close_all()
+                    continue
+
+                self._wait(timeout)
+            except Exception as e:
+                logger.exception(f"{type(self).__name__}: unexpected error: {type(e).__name__}: {str(e)}")
+                self._stop_event.wait(self.poll_interval)
+
+    def _wait(self, timeout: float) -> None:
+        if self._inotify is None:
+            self._stop_event.wait(timeout)
+        else:
+            # returns early if an event occurs in one of the watched directories or if the watcher is stopped
+            poller = select.poll()
+            poller.register(self._inotify.fileno(), select.POLLIN)
+            poller.register(self._wakeup_fds[0], select.POLLIN)
+            if poller.poll(int(timeout * 1000)) and not self._stop_event.is_set():
+                # discard the events (changes are detected via the file states, see get_changed_files)
+                self._inotify.read(timeout=0)
+
+    def sync_tracked_files(self) -> None:
+        """
+        Track the files of all loaded modules (and only those).
+        """
+
+        with util.DATA_LOCK.read():
+            fpaths = set(pyerk.ds.mod_path_mapping.b)
+        fpaths = {fpath for fpath in fpaths if os.path.isfile(fpath)}
+
+        with self.lock:
+            for fpath in list(self.file_states):
+                if fpath not in fpaths:
+                    self.file_states.pop(fpath)
+            for fpath in fpaths:
+                if fpath not in self.file_states:
+                    self.file_states[fpath] = get_file_state(fpath)
+
+        if self._inotify is not None:
+            self._sync_watched_dirs({os.path.dirname(fpath) for fpath in fpaths})
+
+    def _sync_watched_dirs(self, dirpaths: set) -> None:
+        flags = inotify_simple.flags
+        for dirpath in list(self._watched_dirs):
+            if dirpath not in dirpaths:
+                try:
+                    self._inotify.rm_watch(self._watched_dirs.pop(dirpath))
+                except OSError:
+                    # the directory does not exist anymore
+                    pass
+        for dirpath in dirpaths:
+            if dirpath not in self._watched_dirs:
+                mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+                self._watched_dirs[dirpath] = self._inotify.add_watch(dirpath, mask)
+
+    def get_changed_files(self) -> List[str]:
+        """
+        Return the tracked files whose content has changed since the last call.
+        """
+
+        res = []
+        with self.lock:
+            file_states = list(self.file_states.items())
+
+        for fpath, (mtime, size, content_hash) in file_states:
+            try:
+                stat_result = os.stat(fpath)
+            except OSError:
+                # the file was removed (possibly only temporarily by an editor)
+                continue
+            if (stat_result.st_mtime, stat_result.st_size) == (mtime, size):
+                continue
+
+            new_state = get_file_state(fpath)
+            with self.lock:
+                self.file_states[fpath] = new_state
+            if new_state[2] != content_hash:
+                res.append(fpath)
+        return res
+
+    def notify_reloaded(self, fpaths: List[str]) -> None:
+        """
+        Accept the current content of the files as loaded (called after a reload which was not triggered by the
+        watcher, e.g. by the editor, see util.reload_modules_for_path).
+        """
+
+        with self.lock:
+            for fpath in fpaths:
+                if fpath in self.file_states and os.path.isfile(fpath):
+                    self.file_states[fpath] = get_file_state(fpath)
+                self.pending_fpaths.discard(fpath)
+
+    def reload_files(self, fpaths: List[str]) -> List[str]:
+        """
+        Reload the modules of the given files (and their dependents).
+
+        :return:    list of the uris of all unloaded or (re)loaded modules
+        """
+
+        reloaded_mod_uris = []
+        for fpath in fpaths:
+            # the module might already have been reloaded as dependent of another changed module
+            with util.DATA_LOCK.read():
+                mod_uri = pyerk.ds.mod_path_mapping.b.get(fpath)
+            if mod_uri is None or mod_uri in reloaded_mod_uris:
+                continue
+            try:
+                reloaded_mod_uris.extend(util.reload_modules_for_path(fpath))
+            except Exception as e:
+                logger.error(f"{type(self).__name__}: reloading {fpath} failed: {type(e).__name__}: {str(e)}")
+
+        if reloaded_mod_uris:
+            logger.info(f"{type(self).__name__}: reloaded modules: {', '.join(reloaded_mod_uris)}")
+        return reloaded_mod_uris
+
+
+def get_file_state(fpath: str) -> Tuple[float, int, str]:
+    """
+    Return the modification time, the size and the content hash of a file.
+    """
+
+    stat_result = os.stat(fpath)
+    with open(fpath, "rb") as binfile:
+        content_hash = hashlib.sha1(binfile.read()).hexdigest()
+    return stat_result.st_mtime, stat_result.st_size, content_hash
+
+
+def start_watcher_if_enabled() -> Optional[ModuleFileWatcher]:
+    """
+    Start the watcher of this process (once) if `settings.WATCH_ERK_DATA` is true (never during the unittests).
+    """
+
+    global WATCHER
+    if not settings.WATCH_ERK_DATA or settings.RUNNING_TESTS:
+        return None
+
+    with _START_LOCK:
+        if WATCHER is None:
+            WATCHER = ModuleFileWatcher()
+            WATCHER.start()
+    return WATCHER
@@ -5,8 +5,10 @@ import shutil
 from pathlib import Path
 from bs4 import BeautifulSoup
 import unittest
+from unittest import mock
 from django.test import TransactionTestCase, TestCase  # noqa
 from django.urls import reverse
+from django.http import Http404
 from django.db.models import Q
 from textwrap import dedent as twdd
 # noinspection PyUnresolvedReferences
@@ -288,7 +290,7 @@ class Test_02_MainApp(HouskeeperMixin, TestCase):
         url_vis = reverse("entityvisualization", kwargs={"uri": urlquote(u("ma__I9906"))})
         assert url_vis.endswith("/v")
 
-        # the following is necessary due to the temporary replace-hack views.entity_view, see bookmark://vis01
+        # the following is necessary due to the replace-hack in vis_integration._create_svg_file, see bookmark://vis01
 
         # noinspection PyUnresolvedReferences
         url_vis2 = urllib.parse.unquote(url_vis)
@@ -348,6 +350,908 @@ class Test_02_MainApp(HouskeeperMixin, TestCase):
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
 
+    def test12_incremental_db_sync(self):
+
+        n_entities = models.Entity.objects.count()
+
+        # after the full load every entity is linked to exactly one label (see util._link_labels)
+        LabelThrough = models.Entity.label.through
+        self.assertGreater(n_entities, 0)
+        self.assertEqual(LabelThrough.objects.count(), n_entities)
+        self.assertEqual(LabelThrough.objects.values("entity_id").distinct().count(), n_entities)
+        self.assertEqual(LabelThrough.objects.values("languagespecifiedstring_id").distinct().count(), n_entities)
+
+        # the linked labels match the loaded data
+        rows = LabelThrough.objects.values_list(
+            "entity__uri", "languagespecifiedstring__content", "languagespecifiedstring__langtag"
+        )
+        for uri, content, langtag in rows:
+            rdf_literal = p.aux.ensure_rdf_str_literal(p.ds.get_entity_by_uri(uri).R1)
+            self.assertEqual((content, langtag), (rdf_literal.value, rdf_literal.language))
+
+        db_entity = models.Entity.objects.get(uri=u("I13"))
+        self.assertEqual(db_entity.get_label(), "mathematical set")
+
+        # nothing changed since custom_setUp
+        res = pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+        self.assertEqual((res.created, res.updated, res.deleted), (0, 0, 0))
+        self.assertEqual(res.unchanged, n_entities)
+
+        with p.uri_context(uri=TEST_BASE_URI):
+            I901 = p.create_item(R1__has_label="sync test item", R2__has_description="first description")
+
+        res = pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+        self.assertEqual((res.created, res.updated, res.deleted), (1, 0, 0))
+        db_entity = models.Entity.objects.get(uri=I901.uri)
+        pk = db_entity.pk
+
+        # simulate outdated content in the db
+        models.Entity.objects.filter(uri=I901.uri).update(description="outdated", content_hash="outdated")
+        res = pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+        self.assertEqual((res.created, res.updated, res.deleted), (0, 1, 0))
+
+        db_entity = models.Entity.objects.get(uri=I901.uri)
+        self.assertEqual(db_entity.pk, pk)
+        self.assertEqual(db_entity.description, "first description")
+        self.assertEqual(db_entity.get_label(), "sync test item")
+
+        p.unload_mod(TEST_BASE_URI)
+        res = pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+        self.assertEqual((res.created, res.updated, res.deleted), (0, 0, 1))
+        self.assertEqual(models.Entity.objects.count(), n_entities)
+
+        # re-register the module to allow the regular tearDown
+        self.register_this_module()
+
+    def test13_get_db_entity(self):
+
+        uri = u("I12")
+        self.assertIn(uri, pyerkdjango.util.URI_PK_MAP)
+
+        # this does not perform a query
+        with self.assertNumQueries(0):
+            db_entity = pyerkdjango.util.get_db_entity(uri)
+
+        self.assertEqual(db_entity.pk, models.Entity.objects.get(uri=uri).pk)
+
+        # deferred fields are loaded on demand
+        self.assertEqual(db_entity.get_label(), "mathematical object")
+
+        with self.assertRaises(Http404):
+            pyerkdjango.util.get_db_entity("erk:/unknown#I1")
+
+    def test14_search_engines(self):
+        from django.db import connection
+        from pyerkdjango import search
+
+        fts_engine = search.ENGINES["fts5"]
+        self.assertTrue(fts_engine.is_available())
+
+        # only the active engine is synchronized during loading
+        memory_engine = search.ENGINES["memory"]
+        memory_engine.sync_index(pyerkdjango.util.get_entity_records())
+        fts_engine.sync_index(pyerkdjango.util.get_entity_records())
+
+        for engine in search.ENGINES.values():
+            uris, total = engine.search("mathematical se")
+            self.assertIn(u("I13"), uris)
+            self.assertNotIn(u("I12"), uris)
+            self.assertEqual(total, len(uris))
+
+        # the label match of I13 ("mathematical set") should be ranked high
+        uris, total = fts_engine.search("set", limit=10)
+        self.assertIn(u("I13"), uris)
+        self.assertEqual(len(uris), 10)
+
+        self.assertEqual(fts_engine.create_match_expression("R4__inst"), '"R4"* "inst"*')
+        self.assertEqual(fts_engine.search(" -- "), ([], 0))
+
+        # the memory engine has the same semantics as the icontains engine
+        for q in ("set", "I1", "bound", "xyz_unknown"):
+            self.assertEqual(memory_engine.search(q), search.ENGINES["icontains"].search(q))
+            self.assertEqual(memory_engine.search(q, 3, 5), search.ENGINES["icontains"].search(q, 3, 5))
+
+        # incremental update
+        with p.uri_context(uri=TEST_BASE_URI):
+            I902 = p.create_item(R1__has_label="memory index test item")
+        memory_engine.sync_index(pyerkdjango.util.get_entity_records())
+        self.assertEqual(memory_engine.search("index test item"), ([I902.uri], 1))
+
+        with p.uri_context(uri=TEST_BASE_URI):
+            I904 = p.create_item(R1__has_label="substring search controller item")
+        pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+
+        # by default, queries also match in the middle of words
+        self.assertEqual(search.get_search_engine().name, "icontains")
+        self.assertIn(I904.uri, search.search("troll")[0])
+        res = self.client.get("/search/?q=troll")
+        self.assertIn("substring search controller item", "".join(json.loads(res.content)["data"]))
+
+        # fts5 (opt-in): rows of entities which are not in the db are neither counted nor returned
+        fts_engine.sync_index(pyerkdjango.util.get_entity_records())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.FTS_TABLE_NAME} (rowid, uri, label, description, content_hash) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [10**9, "erk:/stale#I1", "stale controller", "", ""],
+            )
+        uris, total = fts_engine.search("controller")
+        self.assertIn(I904.uri, uris)
+        self.assertNotIn("erk:/stale#I1", uris)
+        self.assertEqual(total, len(uris))
+
+        # the fts table is cleared together with the db
+        pyerkdjango.util.unload_data(strict=False)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {search.FTS_TABLE_NAME}")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test15_search_api_pagination(self):
+
+        res = self.client.get("/search/?q=a&limit=20")
+        data = json.loads(res.content)
+        self.assertEqual(len(data["data"]), 20)
+        self.assertGreater(data["total"], 20)
+        self.assertEqual(data["next_offset"], 20)
+        self.assertIn('id="copy_text_0"', data["data"][0])
+
+        res = self.client.get(f"/search/?q=a&limit=20&offset={data['next_offset']}")
+        data2 = json.loads(res.content)
+        self.assertEqual(data2["total"], data["total"])
+        self.assertIn('id="copy_text_20"', data2["data"][0])
+        self.assertNotEqual(data["data"][0], data2["data"][0])
+
+        res = self.client.get(f"/search/?q=a&offset={data['total'] - 1}")
+        data3 = json.loads(res.content)
+        self.assertEqual(len(data3["data"]), 1)
+        self.assertIsNone(data3["next_offset"])
+
+    def test16_sort_key_columns(self):
+        from pyerkdjango import search
+
+        db_entity = models.Entity.objects.get(uri=u("I12"))
+        self.assertEqual((db_entity.sort_auto, db_entity.sort_letter, db_entity.sort_num), (False, "I", 12))
+
+        # ordering by the db columns is consistent with _entity_sort_key
+        uris = list(models.Entity.objects.order_by(*search.SORT_KEY_FIELDS).values_list("uri", flat=True))
+        code_entities = [p.ds.get_entity_by_uri(uri) for uri in uris]
+        self.assertEqual(code_entities, sorted(code_entities, key=search._entity_sort_key))
+
+    def test17_render_cache(self):
+        from pyerkdjango import views
+
+        cache = views.RENDER_CACHE
+        entity = p.ds.get_entity_by_uri(u("I12"))
+
+        hits, misses = cache.hits, cache.misses
+        res1 = views.render_entity_inline(entity, idx=0, include_description=True)
+        res2 = views.render_entity_inline(entity, idx=0, include_description=True)
+        self.assertEqual(res1, res2)
+        self.assertEqual((cache.hits - hits, cache.misses - misses), (1, 1))
+
+        # other options result in another cache entry
+        res3 = views.render_entity_inline(entity, idx=1, include_description=True)
+        self.assertNotEqual(res1, res3)
+        self.assertEqual(cache.misses - misses, 2)
+
+        # changed data invalidates the cache
+        generation = pyerkdjango.util.DATA_GENERATION
+        pyerkdjango.util.reload_data_if_necessary(force=True)
+        self.assertGreater(pyerkdjango.util.DATA_GENERATION, generation)
+        self.assertEqual(len(cache), 0)
+
+        res = self.client.get(reverse("cache_stats"))
+        data = json.loads(res.content)["data"]
+        self.assertEqual(data["caches"]["render_entity_inline"]["size"], 0)
+
+    def test18_entity_dict_cache(self):
+        from pyerkdjango import views
+
+        entity = p.ds.get_entity_by_uri(u("I12"))
+        d1 = views.represent_entity_as_dict(entity)
+        d2 = views.represent_entity_as_dict(entity)
+        self.assertIs(d1, d2)
+
+        # the cached data is read-only
+        with self.assertRaises(TypeError):
+            d1["label"] = "foo"
+
+        # highlighting does not affect the cached data
+        label = d1["label"]
+        views.render_entity_inline(entity, highlight_text=label[:3])
+        self.assertEqual(views.represent_entity_as_dict(entity)["label"], label)
+        self.assertNotIn("hl_label", d1)
+
+        pyerkdjango.util.bump_data_generation()
+        self.assertIsNot(views.represent_entity_as_dict(entity), d1)
+
+    def test19_url_builder(self):
+
+        for uri in (u("I12"), u("ma__I9906"), "erk:/some/mod/0.1#I1234", "erk:/spécial ünicode#R5"):
+            url = reverse("entitypage", kwargs={"uri": urlquote(uri)})
+            self.assertEqual(q_reverse("entitypage", uri), url)
+
+            url = reverse("entityvisualization", kwargs={"uri": urlquote(uri)})
+            self.assertEqual(q_reverse("entityvisualization", uri), url)
+
+    def test20_entity_relations_rendering(self):
+
+        uri = u("I12")
+        url = reverse("entitypage", kwargs=dict(uri=w("I12")))
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+
+        soup = BeautifulSoup(res.content.decode("utf8"), "lxml")
+        page_size = settings.RELATIONS_PAGE_SIZE
+
+        for css_class, statements in (("entity-relations-direct", p.ds.statements),
+                                      ("entity-relations-inverse", p.ds.inv_statements)):
+            re_lists = [re_list for key, re_list in statements[uri].items() if re_list and key not in ("R1", "R2")]
+            container = soup.find("div", attrs={"class": css_class})
+            relation_lists = container.find_all("ul", attrs={"class": "entity-relations"})
+
+            # one list per relation key, every list only contains the first page
+            self.assertEqual(len(relation_lists), len(re_lists))
+            for relation_list, re_list in zip(relation_lists, re_lists):
+                rows = relation_list.find_all("li", attrs={"class": "entity-relation-edge"})
+                self.assertEqual(len(rows), min(len(re_list), page_size))
+
+                # every row contains three cells; the main entity is highlighted
+                for row in rows:
+                    self.assertEqual(len(row.find_all("span", recursive=False)), 3)
+                    keys = row.find_all("span", attrs={"class": "entity-key"})
+                    main_key = keys[0] if css_class == "entity-relations-direct" else keys[-1]
+                    self.assertIn("highlight", main_key["class"])
+
+    def test21_relations_api(self):
+
+        uri = u("I12")
+        rel_key, re_list = max(p.ds.inv_statements[uri].items(), key=lambda item: len(item[1]))
+
+        url = reverse("relations", kwargs=dict(uri=w("I12")))
+        rows = []
+        offset = 0
+        while offset is not None:
+            res = self.client.get(url, {"direction": "inverse", "key": rel_key, "offset": offset, "limit": 7})
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.content)
+            self.assertEqual(data["total"], len(re_list))
+            self.assertLessEqual(len(data["data"]), 7)
+            rows.extend(data["data"])
+            offset = data["next_offset"]
+
+        self.assertEqual(len(rows), len(re_list))
+        self.assertTrue(all(row.startswith('<li class="entity-relation-edge">') for row in rows))
+
+        # the rows are sanitized like those of the detail page
+        from django_bleach.templatetags.bleach_tags import bleach_value
+        from pyerkdjango import views
+
+        with mock.patch.object(views, "_render_relation_rows", return_value=['<li><script>alert(1)</script></li>']):
+            res = self.client.get(url, {"direction": "inverse", "key": rel_key})
+        self.assertEqual(json.loads(res.content)["data"], [bleach_value('<li><script>alert(1)</script></li>')])
+        self.assertNotIn("<script>", json.loads(res.content)["data"][0])
+
+        res = self.client.get(url, {"direction": "sideways", "key": rel_key})
+        self.assertEqual(res.status_code, 400)
+
+        url = reverse("relations", kwargs=dict(uri=urlquote("erk:/unknown#I1")))
+        res = self.client.get(url, {"key": rel_key})
+        self.assertEqual(res.status_code, 404)
+
+    def test22_scope_index(self):
+        from pyerkdjango import scope_index
+
+        index = scope_index.SCOPE_INDEX
+        self.assertEqual(set(index.indexed_mods), set(p.ds.uri_mod_dict))
+
+        # the index contains the same data as the direct computation
+        self.assertGreater(len(index.scopes), 0)
+        for uri, scope_data_list in index.scopes.items():
+            entity = p.ds.get_entity_by_uri(uri)
+            self.assertEqual(index.get_scopes(entity), scope_index.create_scope_data(entity))
+
+        # the lookup does not synchronize the index
+        uri = next(iter(index.scopes))
+        url = reverse("entitypage", kwargs=dict(uri=urlquote(uri)))
+        with mock.patch.object(index, "sync", side_effect=AssertionError):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(f"<h4>{index.scopes[uri][0].name}</h4>", res.content.decode("utf8"))
+
+        # reloading the modules rebuilds the respective entries
+        old_mods = dict(index.indexed_mods)
+        pyerkdjango.util.reload_data_if_necessary(force=True, speedup=False)
+        self.assertIn(MATH_URI, index.indexed_mods)
+        self.assertIsNot(index.indexed_mods[MATH_URI], old_mods[MATH_URI])
+        self.assertEqual(index.sync(), [])
+
+    def test23_conditional_get_and_page_cache(self):
+
+        url = reverse("entitypage", kwargs=dict(uri=w("I12")))
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(pyerkdjango.util.get_data_version(), res["ETag"])
+        self.assertIn("Last-Modified", res)
+
+        res2 = self.client.get(url, HTTP_IF_NONE_MATCH=res["ETag"])
+        self.assertEqual(res2.status_code, 304)
+
+        # the second response comes from the page cache (i.e. the page is not rendered again)
+        with mock.patch("pyerkdjango.views.render_entity_relations", side_effect=AssertionError):
+            res3 = self.client.get(url)
+        self.assertEqual(res3.content, res.content)
+
+        # changed data results in a new version
+        pyerkdjango.util.bump_data_generation()
+        res4 = self.client.get(url, HTTP_IF_NONE_MATCH=res["ETag"])
+        self.assertEqual(res4.status_code, 200)
+        self.assertNotEqual(res4["ETag"], res["ETag"])
+
+    def test24_visualization_cache(self):
+        import tempfile
+        from django.test import override_settings
+        from pyerkdjango import vis_integration
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        override = override_settings(VIS_CACHE_DIR=tmp_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        uri = u("ct__I9907")
+        fpath = vis_integration.get_cache_path(uri, depth=1)
+        self.assertTrue(fpath.startswith(tmp_dir))
+        self.assertFalse(os.path.exists(fpath))
+
+        url = reverse("entityvisualization", kwargs=dict(uri=w("ct__I9907")))
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(os.path.isfile(fpath))
+
+        # the cached data is served as-is
+        with open(fpath) as txtfile:
+            svg_data = txtfile.read()
+        self.assertIn(f"utc_visualization_of_{uri}", svg_data)
+        self.assertIn("%2523I9906/v", svg_data)
+        self.assertIn(svg_data, res.content.decode("utf8"))
+
+        res = self.client.get(reverse("entityvisualization_svg", kwargs=dict(uri=w("ct__I9907"))))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], "image/svg+xml")
+        self.assertEqual(res.content.decode("utf8"), svg_data)
+
+        # the cache key only depends on the content of the loaded data (i.e. the cache survives a restart)
+        pyerkdjango.util.bump_data_generation()
+        with mock.patch.object(pyerkdjango.util, "PROCESS_TOKEN", "restarted"):
+            self.assertEqual(vis_integration.get_cache_path(uri, depth=1), fpath)
+
+        # directories which were not used for a long time are removed
+        old_dir = os.path.join(tmp_dir, "outdated")
+        os.mkdir(old_dir)
+        os.utime(old_dir, (0, 0))
+        vis_integration.prune_cache(keep=os.path.dirname(fpath))
+        self.assertFalse(os.path.exists(old_dir))
+        self.assertTrue(os.path.isfile(fpath))
+
+        # errors are reported as json
+        url = reverse("entityvisualization_svg", kwargs=dict(uri=w("I12")))
+        with mock.patch.object(vis_integration, "visualize_entity", side_effect=ValueError("test error")):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("ValueError: test error", json.loads(res.content)["msg"])
+        self.assertEqual(vis_integration._PENDING, {})
+
+        # pages with a pending visualization are not cached
+        url = reverse("entityvisualization", kwargs=dict(uri=w("I12")))
+        with mock.patch.object(vis_integration, "create_visualization", return_value=None):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("no-store", res["Cache-Control"])
+
+        # the next request renders the page again (i.e. it contains the finished visualization)
+        svg_data = "<svg><!-- utc_finished_visualization --></svg>"
+        with mock.patch.object(vis_integration, "create_visualization", return_value=svg_data):
+            res = self.client.get(url)
+        self.assertIn("utc_finished_visualization", res.content.decode("utf8"))
+        self.assertNotIn("no-store", res.get("Cache-Control", ""))
+
+    def test25_visualization_depth(self):
+        from pyerkdjango import vis_integration
+
+        uri = u("ct__I9907")
+        G1, truncated = vis_integration.create_nx_graph(uri, depth=1, url_template="")
+        self.assertFalse(truncated)
+        G2, truncated = vis_integration.create_nx_graph(uri, depth=2, url_template="")
+        self.assertFalse(truncated)
+        self.assertGreater(G2.number_of_nodes(), G1.number_of_nodes())
+
+        url = reverse("entityvisualization", kwargs=dict(uri=w("ct__I9907")))
+        res = self.client.get(url, {"depth": 2})
+        self.assertEqual(res.status_code, 200)
+        content = res.content.decode("utf8")
+        self.assertIn(f"utc_visualization_of_{uri}", content)
+        self.assertNotIn("utc_visualization_truncated", content)
+
+        # the links keep the depth
+        self.assertIn("/v?depth=2", content)
+
+        with self.settings(VIS_MAX_NODES=3):
+            G, truncated = vis_integration.create_nx_graph(uri, depth=2, url_template="")
+            self.assertTrue(truncated)
+            # three nodes (the budget) + the marker node
+            self.assertEqual(G.number_of_nodes(), 4)
+
+            res = self.client.get(url, {"depth": 3})
+            self.assertIn("utc_visualization_truncated", res.content.decode("utf8"))
+
+        # a statement between two entities is added only once (although both entities have a relation edge for it)
+        entity = p.ds.get_entity_by_uri(uri)
+        re = next(
+            re for re_list in entity.get_relations().values() for re in re_list
+            if isinstance(re.relation_tuple[2], p.Entity)
+        )
+        obj = re.relation_tuple[2]
+        inv_re = next(
+            inv_re for re_list in obj.get_inv_relations().values() for inv_re in re_list
+            if inv_re.relation_tuple[:2] == re.relation_tuple[:2]
+        )
+        self.assertEqual(vis_integration._get_edge_key(inv_re), vis_integration._get_edge_key(re))
+
+    def test26_sparql_caches(self):
+        from pyerkdjango import sparql
+
+        qsrc = twdd(p.rdfstack.get_sparql_example_query())
+        hits = sparql.RESULT_CACHE.hits
+
+        res1 = sparql.perform_sparql_query(qsrc)
+        self.assertGreater(len(res1.rows), 0)
+
+        # queries which only differ in whitespace share the cache entries
+        res2 = sparql.perform_sparql_query(f"\n  {qsrc}  \n\n")
+        self.assertIs(res1, res2)
+        self.assertEqual(sparql.RESULT_CACHE.hits, hits + 1)
+
+        url = reverse("sparqlpage")
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sparql.RESULT_CACHE.hits, hits + 2)
+
+        # changed data invalidates the caches and the rdf graph
+        graph = sparql.get_rdf_graph()
+        pyerkdjango.util.bump_data_generation()
+        self.assertIsNone(p.ds.rdfgraph)
+        self.assertEqual(len(sparql.PREPARED_QUERY_CACHE), 0)
+        res3 = sparql.perform_sparql_query(qsrc)
+        self.assertIsNot(res3, res1)
+        self.assertIsNot(sparql.get_rdf_graph(), graph)
+        self.assertEqual(res3.rows, res1.rows)
+
+        res = self.client.get(reverse("cache_stats"))
+        self.assertIn("sparql_results", json.loads(res.content)["data"]["caches"])
+
+        # prefixes which are bound to the graph can be used without declaration
+        qsrc = "SELECT ?s ?o WHERE { ?s utc_bi:R4 ?o . }"
+        with self.assertRaises(sparql.InvalidQueryError):
+            sparql.get_prepared_query(qsrc)
+
+        sparql.get_rdf_graph().bind("utc_bi", "erk:/builtins#")
+        res = sparql.perform_sparql_query(qsrc)
+        self.assertGreater(len(res.rows), 0)
+
+        res = self.client.get(reverse("sparql_api"), {"query": qsrc})
+        self.assertEqual(res.status_code, 200)
+
+    def test27_sparql_paging(self):
+
+        qsrc = twdd(p.rdfstack.get_sparql_example_query())
+        url = reverse("sparqlpage")
+        res = self.client.get(url, {"query": qsrc, "limit": 2})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+
+        soup = BeautifulSoup(b"".join(res.streaming_content).decode("utf8"), "lxml")
+        table = soup.find("div", attrs={"class": "result-table"}).find("table")
+        self.assertEqual(len(table.find("tbody").find_all("tr", recursive=False)), 2)
+        self.assertEqual(len(table.find_all("span", attrs={"class": "entity-inline-wrapper"})), 4)
+
+        # only the rows of the first page (and one more row) are evaluated
+        from pyerkdjango import sparql
+        self.assertLessEqual(sparql.perform_sparql_query(qsrc).fetch(0), 3)
+
+        # follow the "more results" link until the end; the evaluation of the cached result is continued
+        n_rows = 2
+        more_link = soup.find("a", string="more results")
+        with mock.patch.object(sparql, "get_rdf_graph", side_effect=AssertionError):
+            while more_link is not None:
+                res = self.client.get(more_link["href"])
+                soup = BeautifulSoup(b"".join(res.streaming_content).decode("utf8"), "lxml")
+                n_rows += len(soup.find("div", attrs={"class": "result-table"}).find("tbody").find_all("tr"))
+                more_link = soup.find("a", string="more results")
+
+        self.assertEqual(n_rows, len(sparql.perform_sparql_query(qsrc).rows))
+        self.assertIn(f"of <strong>{n_rows}</strong>", soup.find("p", attrs={"class": "result-info"}).decode())
+
+    def test28_sparql_api(self):
+
+        from pyerkdjango import sparql
+
+        qsrc = twdd(p.rdfstack.get_sparql_example_query())
+        n_rows = len(sparql.perform_sparql_query(qsrc).rows)
+        url = reverse("sparql_api")
+
+        res = self.client.get(url, {"query": qsrc, "labels": "1"})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "application/sparql-results+json")
+        self.assertEqual(int(res["X-Total-Count"]), n_rows)
+        data = json.loads(b"".join(res.streaming_content))
+        var = data["head"]["vars"][0]
+        self.assertIn(f"{var}Label", data["head"]["vars"])
+        self.assertEqual(len(data["results"]["bindings"]), n_rows)
+        binding = data["results"]["bindings"][0]
+        self.assertEqual(binding[var]["type"], "uri")
+        self.assertEqual(binding[f"{var}Label"]["value"], str(p.ds.get_entity_by_uri(binding[var]["value"]).R1))
+
+        res = self.client.get(url, {"query": qsrc, "format": "ndjson", "limit": 2})
+        lines = b"".join(res.streaming_content).decode("utf8").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertNotIn(f"{var}Label", json.loads(lines[0]))
+
+        res = self.client.get(url, {"query": qsrc, "format": "csv"})
+        self.assertEqual(res["Content-Type"], "text/csv")
+        lines = b"".join(res.streaming_content).decode("utf8").splitlines()
+        self.assertEqual(len(lines), n_rows + 1)
+
+        res = self.client.get(url, {"query": "foo bar"})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.get(url, {"query": qsrc, "format": "xml"})
+        self.assertEqual(res.status_code, 400)
+
+        # undeclared prefix
+        res = self.client.get(url, {"query": "SELECT ?s WHERE { ?s unknown:R4 ?o . }"})
+        self.assertEqual(res.status_code, 400)
+
+        # only SELECT queries are supported
+        for query in ("ASK { ?s ?p ?o . }", "CONSTRUCT { ?s ?p ?o . } WHERE { ?s ?p ?o . }"):
+            res = self.client.get(url, {"query": query})
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("only SELECT queries", json.loads(res.content)["msg"])
+
+        # queries are rejected while all workers are busy
+        for _ in range(settings.SPARQL_API_WORKERS):
+            self.assertTrue(sparql._WORKER_SLOTS.acquire(blocking=False))
+        try:
+            res = self.client.get(url, {"query": qsrc})
+            self.assertEqual(res.status_code, 503)
+        finally:
+            for _ in range(settings.SPARQL_API_WORKERS):
+                sparql._WORKER_SLOTS.release()
+        res = self.client.get(url, {"query": qsrc})
+        self.assertEqual(res.status_code, 200)
+
+    def test29_auto_complete_list(self):
+
+        from pyerkdjango import completion
+
+        # the complete list (not used by the editor anymore) contains the same suggestions as the completion index
+        url = reverse("get_auto_complete_list")
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        completion_suggestions = json.loads(res.content)["data"]
+        self.assertIn("R4__is_instance_of", completion_suggestions)
+        self.assertEqual(sorted(completion.get_index().suggestions), sorted(completion_suggestions))
+
+    def test30_completion_api(self):
+
+        from pyerkdjango import completion
+
+        url = reverse("complete")
+        res = self.client.get(url, {"prefix": "r4", "limit": 5})
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.content)["data"]
+        self.assertEqual(len(data), 5)
+        self.assertTrue(json.loads(res.content)["truncated"])
+        self.assertTrue(all(d["value"].lower().startswith("r4") for d in data))
+        self.assertIn("R4__is_instance_of", [d["value"] for d in data])
+
+        # matches are ranked by usage
+        scores = [d["score"] for d in data]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        res = self.client.get(url, {"prefix": "R4__"})
+        self.assertEqual(json.loads(res.content)["data"][0]["value"], "R4__is_instance_of")
+
+        res = self.client.get(url, {"prefix": "no_such_prefix"})
+        self.assertEqual(json.loads(res.content)["data"], [])
+        self.assertFalse(json.loads(res.content)["truncated"])
+
+        # the ranked matches of prefixes with many matches are precomputed (the range is not scanned)
+        suggestions = [(f"R{i}", i % 7) for i in range(100)]
+        with mock.patch.object(completion, "_MAX_SCAN_SIZE", 5):
+            index = completion.CompletionIndex(suggestions, top_limit=10)
+        self.assertIn("r", index.top_matches)
+        self.assertNotIn("r12", index.top_matches)
+        ranked = sorted(suggestions, key=lambda item: (-item[1], item[0]))
+        with mock.patch.object(index, "_rank", side_effect=AssertionError):
+            self.assertEqual(index.complete("R", 10), ranked[:10])
+            self.assertEqual(index.complete("r", 3), ranked[:3])
+        self.assertEqual(index.complete("R", 20), ranked[:20])
+        self.assertEqual(index.complete("R12", 5), [("R12", 5)])
+
+    def test31_search_result_cache(self):
+
+        import time
+        from pyerkdjango import search, caching
+
+        url = reverse("search")
+        res = self.client.get(url, {"q": "square matrix"})
+        self.assertGreater(json.loads(res.content)["total"], 0)
+
+        # the query is normalized; the second response comes from the cache
+        with mock.patch.object(search, "get_search_engine") as get_search_engine:
+            res2 = self.client.get(url, {"q": "  square   matrix "})
+            get_search_engine.assert_not_called()
+        self.assertEqual(res2.content, res.content)
+
+        # expiration of cache entries
+        cache = caching.LRUCache("test31_ttl_cache", ttl=10)
+        try:
+            cache.set("key", "value")
+            self.assertEqual(cache.get("key"), "value")
+            with mock.patch.object(caching.time, "monotonic", return_value=time.monotonic() + 11):
+                self.assertIsNone(cache.get("key"))
+            self.assertEqual(len(cache), 0)
+        finally:
+            caching.CACHES.pop(cache.name)
+
+    def test32_search_narrowing(self):
+        from django.test import override_settings
+        from pyerkdjango import search
+
+        icontains_engine = search.ENGINES["icontains"]
+        self.assertTrue(icontains_engine.supports_narrowing)
+        self.assertFalse(search.ENGINES["fts5"].supports_narrowing)
+
+        with override_settings(SEARCH_ENGINE="icontains"):
+            uris, total = search.search("mathematical", 0, 5)
+            self.assertEqual((uris, total), icontains_engine.search("mathematical", 0, 5))
+
+            # the extended query is answered by filtering the cached result of "mathematical"
+            with mock.patch.object(search.IContainsSearchEngine, "search") as engine_search:
+                res = search.search("Mathematical Se")
+                engine_search.assert_not_called()
+
+        self.assertEqual(res, icontains_engine.search("mathematical se"))
+        self.assertIn(u("I13"), res[0])
+
+        # large results are neither fetched completely nor cached
+        with override_settings(SEARCH_ENGINE="icontains", SEARCH_CANDIDATE_MAX_SIZE=10):
+            with mock.patch.object(icontains_engine, "search", wraps=icontains_engine.search) as engine_search:
+                uris, total = search.search("set", 0, 5)
+                engine_search.assert_called_once_with("set", offset=0, limit=5)
+            self.assertGreater(total, 10)
+            self.assertIsNone(search.get_cached_candidates(icontains_engine, "set"))
+
+        # case folding of non-ASCII characters
+        with p.uri_context(uri=TEST_BASE_URI):
+            I903 = p.create_item(R1__has_label="narrowing Übergang test item")
+        pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+
+        with override_settings(SEARCH_ENGINE="icontains"):
+            self.assertEqual(search.search("narrowing "), ([I903.uri], 1))
+
+            # narrowed and direct results are identical (also for non-ASCII characters, whose case-insensitive
+            # matching depends on the database)
+            for q in ("narrowing übergang", "narrowing Übergang", "narrowing ÜBERGANG test", "NARROWING Ü"):
+                with mock.patch.object(search.IContainsSearchEngine, "search") as engine_search:
+                    res = search.search(q)
+                    engine_search.assert_not_called()
+                self.assertEqual(res, icontains_engine.search(q))
+
+    def test33_module_scoped_reload(self):
+        import tempfile
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+
+        base_fpath = os.path.join(tmp_dir, "reload_test_base.py")
+        base_src = twdd("""
+            import pyerk as p
+            __URI__ = "erk:/local/reload_test/base"
+            keymanager = p.KeyManager()
+            p.register_mod(__URI__, keymanager)
+            p.start_mod(__URI__)
+            I1000 = p.create_item(R1__has_label="reload test base item")
+            p.end_mod()
+        """)
+        dep_src = twdd("""
+            import pyerk as p
+            base = p.erkloader.load_mod_from_path("./reload_test_base.py", prefix="rtb")
+            __URI__ = "erk:/local/reload_test/dep"
+            keymanager = p.KeyManager()
+            p.register_mod(__URI__, keymanager)
+            p.start_mod(__URI__)
+            I2000 = p.create_item(R1__has_label="reload test dependent item", R4__is_instance_of=base.I1000)
+            p.end_mod()
+        """)
+        with open(base_fpath, "w") as txtfile:
+            txtfile.write(base_src)
+        with open(os.path.join(tmp_dir, "reload_test_dep.py"), "w") as txtfile:
+            txtfile.write(dep_src)
+
+        p.erkloader.load_mod_from_path(os.path.join(tmp_dir, "reload_test_dep.py"), prefix="rtd")
+        pyerkdjango.util.load_erk_entities_to_db(speedup=False)
+
+        base_uri, dep_uri = "erk:/local/reload_test/base", "erk:/local/reload_test/dep"
+        self.assertEqual(pyerkdjango.util.get_dependent_mod_uris(base_uri), [dep_uri, base_uri])
+        math_mod = p.ds.uri_mod_dict[MATH_URI]
+
+        url = reverse("save_file")
+        post_data = {"editor_content": base_src.replace("base item", "changed item"), "fpath": base_fpath}
+        res = self.client.post(url, json.dumps(post_data), content_type="application/json")
+        self.assertEqual(res.status_code, 302)
+
+        # only the saved module and its dependent were reloaded
+        self.assertIs(p.ds.uri_mod_dict[MATH_URI], math_mod)
+        I1000 = p.ds.get_entity_by_uri(f"{base_uri}#I1000")
+        self.assertEqual(I1000.R1, "reload test changed item")
+        self.assertEqual(p.ds.get_entity_by_uri(f"{dep_uri}#I2000").R4, I1000)
+
+        db_entity = models.Entity.objects.get(uri=I1000.uri)
+        self.assertEqual(db_entity.get_label(), "reload test changed item")
+        self.assertTrue(models.Entity.objects.filter(uri=u("I13")).exists())
+
+        # errors are reported; the file is saved but the previous version of the modules stays loaded (also if the
+        # next attempt fails, too)
+        for content in ("1/0", "1/0 # second attempt"):
+            post_data["editor_content"] = content
+            res = self.client.post(url, json.dumps(post_data), content_type="application/json")
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("ZeroDivisionError", json.loads(res.content)["data"]["msg"])
+
+            with open(base_fpath) as txtfile:
+                self.assertEqual(txtfile.read(), content)
+            self.assertIn(base_uri, p.ds.uri_mod_dict)
+            self.assertIn(dep_uri, p.ds.uri_mod_dict)
+            I1000 = p.ds.get_entity_by_uri(f"{base_uri}#I1000")
+            self.assertEqual(I1000.R1, "reload test changed item")
+            self.assertEqual(p.ds.get_entity_by_uri(f"{dep_uri}#I2000").R4, I1000)
+            self.assertEqual(models.Entity.objects.get(uri=I1000.uri).get_label(), "reload test changed item")
+            self.assertTrue(models.Entity.objects.filter(uri=f"{dep_uri}#I2000").exists())
+
+        # a working version replaces the previous one
+        post_data["editor_content"] = base_src
+        res = self.client.post(url, json.dumps(post_data), content_type="application/json")
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(p.ds.get_entity_by_uri(f"{base_uri}#I1000").R1, "reload test base item")
+        self.assertEqual(pyerkdjango.util.LOADED_SOURCE_OVERRIDES, {})
+
+        # only the files of loaded modules can be saved
+        for invalid_fpath in (None, os.path.join(tmp_dir, "unknown.py")):
+            post_data["fpath"] = invalid_fpath
+            res = self.client.post(url, json.dumps(post_data), content_type="application/json")
+            self.assertEqual(res.status_code, 400)
+        self.assertFalse(os.path.exists(os.path.join(tmp_dir, "unknown.py")))
+
+    def test34_file_watcher(self):
+        import time
+        import tempfile
+        from pyerkdjango import watcher
+
+        # the watcher is never started during the unittests
+        self.assertIsNone(watcher.WATCHER)
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+
+        fpath = os.path.join(tmp_dir, "watcher_test_mod.py")
+        src = twdd("""
+            import pyerk as p
+            __URI__ = "erk:/local/watcher_test"
+            keymanager = p.KeyManager()
+            p.register_mod(__URI__, keymanager)
+            p.start_mod(__URI__)
+            I1000 = p.create_item(R1__has_label="watcher test item")
+            p.end_mod()
+        """)
+        with open(fpath, "w") as txtfile:
+            txtfile.write(src)
+        p.erkloader.load_mod_from_path(fpath, prefix="wt")
+
+        file_watcher = watcher.ModuleFileWatcher()
+        file_watcher.sync_tracked_files()
+        self.assertIn(fpath, file_watcher.file_states)
+        self.assertEqual(file_watcher.get_changed_files(), [])
+
+        # modification time changes without content changes are ignored
+        mtime = os.stat(fpath).st_mtime
+        os.utime(fpath, (mtime + 10, mtime + 10))
+        self.assertEqual(file_watcher.get_changed_files(), [])
+
+        with open(fpath, "w") as txtfile:
+            txtfile.write(src.replace("watcher test item", "changed watcher test item"))
+        os.utime(fpath, (mtime + 20, mtime + 20))
+        self.assertEqual(file_watcher.get_changed_files(), [fpath])
+
+        self.assertEqual(file_watcher.reload_files([fpath]), ["erk:/local/watcher_test"])
+        entity = p.ds.get_entity_by_uri("erk:/local/watcher_test#I1000")
+        self.assertEqual(entity.R1, "changed watcher test item")
+        self.assertEqual(models.Entity.objects.get(uri=entity.uri).get_label(), "changed watcher test item")
+        file_watcher.stop()
+
+        # stopping does not wait for the next check of the files; the inotify file descriptor is closed
+        file_watcher = watcher.ModuleFileWatcher(poll_interval=60)
+        file_watcher.start()
+        start_time = time.monotonic()
+        file_watcher.stop()
+        self.assertLess(time.monotonic() - start_time, 10)
+        self.assertFalse(file_watcher._thread.is_alive())
+        self.assertIsNone(file_watcher._inotify)
+
+    def test35_data_lock(self):
+        import threading
+        from pyerkdjango import locking
+
+        lock = locking.ReadWriteLock()
+        events = []
+
+        def write():
+            with lock.write():
+                events.append("write")
+
+        def read():
+            with lock.read():
+                events.append("read")
+
+        # the writer waits until the reader is finished
+        with lock.read():
+            thread = threading.Thread(target=write)
+            thread.start()
+            thread.join(timeout=0.2)
+            self.assertTrue(thread.is_alive())
+
+            # new readers wait for the waiting writer, threads which already hold a read lock do not
+            reader_thread = threading.Thread(target=read)
+            reader_thread.start()
+            reader_thread.join(timeout=0.2)
+            self.assertTrue(reader_thread.is_alive())
+            with lock.read():
+                events.append("reentrant read")
+        thread.join(timeout=5)
+        reader_thread.join(timeout=5)
+        self.assertEqual(events, ["reentrant read", "write", "read"])
+
+        # a reader can acquire the write lock (reentrant)
+        with lock.read(), lock.write(), lock.read(), lock.write():
+            pass
+
+        # requests hold the read lock of the loaded data until the response is closed (for streamed responses: until
+        # the content is consumed)
+        def write_data():
+            with pyerkdjango.util.DATA_LOCK.write():
+                events.append("write data")
+
+        qsrc = twdd(p.rdfstack.get_sparql_example_query())
+        res = self.client.get(reverse("sparqlpage"), {"query": qsrc})
+        self.assertTrue(res.streaming)
+        thread = threading.Thread(target=write_data)
+        thread.start()
+        thread.join(timeout=0.2)
+        self.assertTrue(thread.is_alive())
+        b"".join(res.streaming_content)
+        thread.join(timeout=5)
+        self.assertEqual(events[-1], "write data")
+
+    def test36_db_synchronized_after_module_reload(self):
+
+        # the db is kept while the modules are unloaded; it is synchronized when the modules are loaded again
+        pyerkdjango.util.unload_data(strict=False, clear_db=False)
+        models.Entity.objects.filter(uri=u("I13")).delete()
+        res = pyerkdjango.util.reload_data_if_necessary(speedup=False)
+        self.assertGreater(res.modules, 0)
+        self.assertTrue(models.Entity.objects.filter(uri=u("I13")).exists())
+
 
 class Test_03_Utils(HouskeeperMixin, unittest.TestCase):
 